@@ -0,0 +1,244 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from src.config import get_settings
+
+# The choices of the deployment workflow's `environment` input
+ENVIRONMENTS = ("dev", "staging", "prod")
+
+# Other spellings accepted for them, shared by admission and the security group policies
+ENVIRONMENT_ALIASES = {"production": "prod", "development": "dev", "stage": "staging"}
+
+def normalize_environment(environment: Any) -> str:
+    """The workflow name for an environment, lowercased with aliases resolved"""
+    name = str(environment or "").strip().lower()
+    return ENVIRONMENT_ALIASES.get(name, name)
+
+class UnknownEnvironment(ValueError):
+    """Raised for an environment the deployment workflow does not accept"""
+
+    def __init__(self, environment: str):
+        super().__init__(f"Unknown environment '{environment}', expected one of: {', '.join(ENVIRONMENTS)}")
+        self.environment = environment
+
+class AdmissionRejected(Exception):
+    """Raised when a provisioning request is over its rate limit or cannot get a dispatch slot"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """Seconds until one token is available (0 if available now)"""
+        self._refill(now if now is not None else time.monotonic())
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+def parse_limits(spec: str) -> Dict[str, float]:
+    """Parse "dev=30,staging=20,prod=5" into a dict"""
+    limits = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            limits[key.strip()] = float(value)
+    return limits
+
+class AdmissionController:
+    """
+    Rate limits and fair dispatch slots for provisioning requests
+
+    Each request must find a token in both its user's bucket and its
+    environment's bucket, then hold one of `max_in_flight` dispatch slots
+    while the GitHub workflow is triggered. When all slots are busy,
+    waiters queue per user and freed slots are handed out round-robin
+    across users, so one user's burst cannot starve the others. Limits
+    apply per worker process. Requests that find no slot, or fail
+    validation (ValueError) inside the block, get their tokens back, as
+    nothing was dispatched.
+    """
+
+    def __init__(
+        self,
+        user_per_minute: float = 10,
+        user_burst: float = 5,
+        env_per_minute: Optional[Dict[str, float]] = None,
+        default_env_per_minute: float = 30,
+        max_in_flight: int = 4,
+        max_queued_per_user: int = 2,
+        queue_timeout: float = 10.0
+    ):
+        self.user_per_minute = user_per_minute
+        self.user_burst = user_burst
+        self.env_per_minute = {normalize_environment(name): limit for name, limit in (env_per_minute or {}).items()}
+        self.default_env_per_minute = default_env_per_minute
+        self.max_in_flight = max_in_flight
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+
+        self._user_buckets: Dict[str, TokenBucket] = {}
+        self._env_buckets: Dict[str, TokenBucket] = {}
+        self._in_flight = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.counters = {
+            "admitted": 0,
+            "refunded": 0,
+            "queued": 0,
+            "rejected_user_rate": 0,
+            "rejected_environment_rate": 0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0
+        }
+
+    def _user_bucket(self, username: str) -> TokenBucket:
+        if username not in self._user_buckets:
+            self._user_buckets[username] = TokenBucket(self.user_per_minute / 60, self.user_burst)
+        return self._user_buckets[username]
+
+    def _env_bucket(self, environment: str) -> TokenBucket:
+        if environment not in self._env_buckets:
+            per_minute = self.env_per_minute.get(environment, self.default_env_per_minute)
+            # Allow a burst of a few seconds' worth, and at least one request
+            self._env_buckets[environment] = TokenBucket(per_minute / 60, max(1.0, per_minute / 6))
+        return self._env_buckets[environment]
+
+    def check_rate(self, username: str, environment: str) -> str:
+        """Consume one token from the user and environment buckets or raise AdmissionRejected; returns the normalized environment"""
+        name = normalize_environment(environment)
+        if name not in ENVIRONMENTS:
+            raise UnknownEnvironment(environment)
+        environment = name
+
+        now = time.monotonic()
+        user_bucket = self._user_bucket(username)
+        env_bucket = self._env_bucket(environment)
+
+        user_wait = user_bucket.wait_time(now)
+        if user_wait > 0:
+            self.counters["rejected_user_rate"] += 1
+            raise AdmissionRejected("Too many provisioning requests for this user", user_wait)
+
+        env_wait = env_bucket.wait_time(now)
+        if env_wait > 0:
+            self.counters["rejected_environment_rate"] += 1
+            raise AdmissionRejected(f"Too many provisioning requests for environment '{environment}'", env_wait)
+
+        user_bucket.consume()
+        env_bucket.consume()
+        return environment
+
+    def refund(self, username: str, environment: str):
+        """Return the tokens taken by check_rate"""
+        self._user_bucket(username).refund()
+        self._env_bucket(environment).refund()
+        self.counters["refunded"] += 1
+
+    async def _acquire_slot(self, username: str):
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            return
+
+        queue = self._waiters.get(username)
+        if queue is not None and len(queue) >= self.max_queued_per_user:
+            self.counters["rejected_queue_full"] += 1
+            raise AdmissionRejected("Too many queued provisioning requests for this user", self.queue_timeout)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(username, deque()).append(future)
+        self.counters["queued"] += 1
+
+        try:
+            # The slot is handed over by _release_slot, so in_flight is already counted
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard_waiter(username, future)
+            self.counters["rejected_queue_timeout"] += 1
+            raise AdmissionRejected("All deployment runners are busy", self.queue_timeout)
+        except asyncio.CancelledError:
+            self._discard_waiter(username, future)
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the request went away
+                self._release_slot()
+            raise
+
+    def _discard_waiter(self, username: str, future: asyncio.Future):
+        queue = self._waiters.get(username)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._waiters[username]
+
+    def _release_slot(self):
+        # Hand the slot to the next user in round-robin order
+        while self._waiters:
+            username, queue = self._waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                self._waiters[username] = queue
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self, username: str, environment: str):
+        """Apply rate limits, then hold a dispatch slot for the body of the block, which gets the normalized environment"""
+        environment = self.check_rate(username, environment)
+        try:
+            await self._acquire_slot(username)
+        except (AdmissionRejected, asyncio.CancelledError):
+            self.refund(username, environment)
+            raise
+        self.counters["admitted"] += 1
+        try:
+            yield environment
+        except ValueError:
+            self.refund(username, environment)
+            raise
+        finally:
+            self._release_slot()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            **self.counters,
+            "in_flight": self._in_flight,
+            "waiting": sum(len(queue) for queue in self._waiters.values()),
+            "max_in_flight": self.max_in_flight
+        }
+
+def create_admission_controller() -> AdmissionController:
+    settings = get_settings()
+    return AdmissionController(
+        user_per_minute=settings.admission_user_per_minute,
+        user_burst=settings.admission_user_burst,
+        env_per_minute=parse_limits(settings.admission_env_per_minute),
+        max_in_flight=settings.admission_max_in_flight,
+        queue_timeout=settings.admission_queue_timeout
+    )
+
+admission = create_admission_controller()
@@ -0,0 +1,135 @@
+import gzip
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from src.config import get_settings
+from src import supabase
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which a deployment no longer changes
+FINISHED_STATUSES = ["completed", "failed", "error"]
+
+# Heavy columns moved to the archive; everything else stays in the hot row
+ARCHIVED_FIELDS = ["logs", "parameters", "outputs"]
+
+class LocalSegmentStore:
+    """Archive segments as files in a directory (use a shared volume with several hosts)"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def put(self, name: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def get(self, name: str) -> bytes:
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+class SupabaseSegmentStore:
+    """Archive segments as objects in a Supabase Storage bucket"""
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def put(self, name: str, data: bytes):
+        supabase.get_client().storage.from_(self.bucket).upload(
+            name, data, {"content-type": "application/gzip"}
+        )
+
+    def get(self, name: str) -> bytes:
+        return supabase.get_client().storage.from_(self.bucket).download(name)
+
+def create_segment_store(url: str):
+    """
+    Build a segment store from a URL
+
+    file:///path/to/dir    local or mounted directory
+    supabase://bucket      Supabase Storage bucket
+    """
+    parsed = urlparse(url)
+
+    if parsed.scheme in ("", "file"):
+        return LocalSegmentStore(parsed.path or "archive")
+    if parsed.scheme == "supabase":
+        return SupabaseSegmentStore(parsed.netloc or "deployment-archive")
+
+    raise ValueError(f"Unsupported archive URL scheme: {parsed.scheme}")
+
+# No store until ARCHIVE_URL says where segments go
+store = create_segment_store(get_settings().archive_url) if get_settings().archive_url else None
+
+def encode_segment(deployments: List[Dict[str, Any]]) -> bytes:
+    """One deployment per line, gzip-compressed"""
+    lines = "".join(json.dumps(deployment, default=str) + "\n" for deployment in deployments)
+    return gzip.compress(lines.encode(), compresslevel=6)
+
+@lru_cache(maxsize=8)
+def read_segment(name: str) -> Dict[str, Dict[str, Any]]:
+    """Load a segment into an id -> deployment map; segments never change once written"""
+    rows = {}
+    for line in gzip.decompress(store.get(name)).decode().splitlines():
+        if line:
+            deployment = json.loads(line)
+            rows[deployment["id"]] = deployment
+    return rows
+
+def archive_finished_deployments(retention_days: Optional[int] = None, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Move finished deployments older than the retention period into one archive segment
+
+    The segment is written before the hot rows are slimmed, so a failure in
+    between only leaves rows to be archived again on the next run.
+    """
+    if store is None:
+        raise RuntimeError("ARCHIVE_URL must be set to archive deployments")
+
+    settings = get_settings()
+    retention_days = retention_days if retention_days is not None else settings.archive_retention_days
+    batch_size = batch_size or settings.archive_batch_size
+
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).isoformat()
+    deployments = supabase.get_archivable_deployments(FINISHED_STATUSES, cutoff, batch_size)
+    if not deployments:
+        return {"archived_count": 0}
+
+    segment = f"deployments-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}.jsonl.gz"
+    store.put(segment, encode_segment(deployments))
+
+    ids = [deployment["id"] for deployment in deployments]
+    supabase.mark_deployments_archived(ids, segment, ARCHIVED_FIELDS)
+    logger.info("Archived %s deployments to %s", len(ids), segment)
+
+    return {"archived_count": len(ids), "segment": segment}
+
+def hydrate(deployment: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Restore archived logs, parameters and outputs onto a slim deployment row"""
+    if not deployment or not deployment.get("archived_segment"):
+        return deployment
+
+    try:
+        archived = read_segment(deployment["archived_segment"]).get(deployment["id"])
+    except Exception as e:
+        logger.error("Error reading archive segment %s: %s", deployment["archived_segment"], e)
+        return deployment
+
+    if not archived:
+        return deployment
+
+    full = dict(deployment)
+    for field in ARCHIVED_FIELDS:
+        full[field] = archived.get(field)
+    return full
@@ -4,19 +4,17 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from pydantic import BaseModel
-import os
 
-from dotenv import load_dotenv
 from passlib.context import CryptContext
+from src.circuit import DependencyUnavailable
+from src.config import get_settings
 from src.supabase import get_user_by_username
 
-# Load environment variables
-load_dotenv()
-
 # Security settings from environment variables
-SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+_settings = get_settings()
+SECRET_KEY = _settings.jwt_secret_key
+ALGORITHM = _settings.jwt_algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES = _settings.jwt_access_token_expire_minutes
 
 # Password context for hashing and verification
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -28,6 +26,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    role: Optional[str] = None
+    email: Optional[str] = None
 
 # User schema
 class User(BaseModel):
@@ -85,17 +85,31 @@ def verify_token(token: str = Depends(oauth2_scheme)):
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
+        token_data = TokenData(username=username, role=payload.get("role"), email=payload.get("email"))
     except JWTError:
         raise credentials_exception
     return token_data
 
 def get_current_user(token_data: TokenData = Depends(verify_token)):
-    user = get_user(token_data.username)
+    try:
+        user = get_user(token_data.username)
+    except DependencyUnavailable:
+        # Supabase is down and the user is not cached here: trust the signed role claim
+        if token_data.role is None:
+            raise
+        return User(username=token_data.username, email=token_data.email, role=token_data.role)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return User(
         username=user["username"],
         email=user["email"],
         role=user["role"]
-    )
\ No newline at end of file
+    )
+
+def get_user_from_token(token: str) -> Optional[User]:
+    """Resolve a bearer token to a user outside of FastAPI dependencies; None if invalid"""
+    try:
+        token_data = verify_token(token)
+        return get_current_user(token_data)
+    except HTTPException:
+        return None
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Channel carrying deployment cache invalidations and status events
+DEPLOYMENTS_CHANNEL = "deployments"
+
+class Broadcast:
+    """
+    In-process event broadcast, and the base class for multi-worker backends
+
+    Subscribers register a handler per channel; handlers may be plain functions
+    or coroutine functions and receive the published message dict. Subclasses
+    carry messages to other workers by implementing _open, _close and _send and
+    feeding whatever they receive into _receive_raw.
+    """
+
+    def __init__(self):
+        self.origin = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._handlers: Dict[str, List[Callable[[Dict[str, Any]], Any]]] = defaultdict(list)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._loop is not None
+
+    def subscribe(self, channel: str, handler: Callable[[Dict[str, Any]], Any]):
+        """Register a handler for messages on a channel"""
+        self._handlers[channel].append(handler)
+
+    def unsubscribe(self, channel: str, handler: Callable[[Dict[str, Any]], Any]):
+        """Remove a previously registered handler"""
+        if handler in self._handlers.get(channel, []):
+            self._handlers[channel].remove(handler)
+
+    async def connect(self):
+        """Bind to the running event loop and open the transport"""
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        try:
+            await self._open()
+        except Exception:
+            self._loop = None
+            self._outbox = None
+            raise
+        self._sender = asyncio.create_task(self._drain_outbox())
+
+    async def disconnect(self):
+        """Stop sending and close the transport"""
+        if self._sender:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+            self._sender = None
+        await self._close()
+        self._loop = None
+        self._outbox = None
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        """
+        Deliver a message to local subscribers and every other worker
+
+        Safe to call from synchronous code and from worker threads. Before
+        connect() only sync local handlers are run.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._dispatch(channel, message)
+            return
+
+        envelope = {"origin": self.origin, "channel": channel, "message": message}
+        self._loop.call_soon_threadsafe(self._dispatch, channel, message)
+        self._loop.call_soon_threadsafe(self._outbox.put_nowait, envelope)
+
+    def _dispatch(self, channel: str, message: Dict[str, Any]):
+        for handler in list(self._handlers.get(channel, [])):
+            try:
+                if asyncio.iscoroutinefunction(handler):
+                    if self._loop is not None:
+                        self._loop.create_task(handler(message))
+                else:
+                    handler(message)
+            except Exception as e:
+                logger.error("Error in broadcast handler for %s: %s", channel, e)
+
+    def _receive_raw(self, data):
+        """Decode an envelope from another worker and dispatch it locally"""
+        try:
+            envelope = json.loads(data)
+        except (TypeError, ValueError) as e:
+            logger.warning("Dropping malformed broadcast message: %s", e)
+            return
+
+        if envelope.get("origin") == self.origin:
+            return
+        self._dispatch(envelope.get("channel"), envelope.get("message", {}))
+
+    async def _drain_outbox(self):
+        while True:
+            envelope = await self._outbox.get()
+            try:
+                await self._send(json.dumps(envelope, default=str))
+            except Exception as e:
+                logger.error("Error sending broadcast message: %s", e)
+
+    async def _open(self):
+        pass
+
+    async def _close(self):
+        pass
+
+    async def _send(self, data: str):
+        # Local subscribers were already notified by publish()
+        pass
+
+class UnixSocketBroadcast(Broadcast):
+    """
+    Broadcast between workers on one host over Unix datagram sockets
+
+    Every worker binds <directory>/<origin>.sock and sends each message to all
+    other sockets in the directory; sockets left behind by dead workers are
+    removed on the first failed send.
+    """
+
+    # Linux rejects datagrams much larger than this with the default buffers
+    MAX_DATAGRAM = 200 * 1024
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self._path: Optional[str] = None
+        self._sock: Optional[socket.socket] = None
+
+    async def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f"{self.origin}.sock")
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._sock.setblocking(False)
+        self._loop.add_reader(self._sock.fileno(), self._on_readable)
+
+    async def _close(self):
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _on_readable(self):
+        while self._sock is not None:
+            try:
+                data = self._sock.recv(self.MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            self._receive_raw(data)
+
+    async def _send(self, data: str):
+        payload = data.encode()
+        if len(payload) > self.MAX_DATAGRAM:
+            logger.warning("Dropping broadcast message of %s bytes", len(payload))
+            return
+
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or peer == self._path:
+                continue
+            try:
+                self._sock.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker exited without cleaning up its socket
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("Broadcast receiver %s is not keeping up, message dropped", name)
+
+class PostgresBroadcast(Broadcast):
+    """
+    Broadcast across hosts with Postgres LISTEN/NOTIFY
+
+    Requires the optional asyncpg package. NOTIFY payloads are limited to
+    8000 bytes, so publish identifiers and small status fields only.
+    """
+
+    MAX_PAYLOAD = 8000
+
+    def __init__(self, dsn: str, pg_channel: str = "platform_hub_events"):
+        super().__init__()
+        self.dsn = dsn
+        self.pg_channel = pg_channel
+        self._conn = None
+
+    async def _open(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError("asyncpg is required for postgres:// broadcast URLs")
+
+        self._conn = await asyncpg.connect(self.dsn)
+        await self._conn.add_listener(self.pg_channel, self._on_notify)
+
+    async def _close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._receive_raw(payload)
+
+    async def _send(self, data: str):
+        if len(data.encode()) > self.MAX_PAYLOAD:
+            logger.warning("Dropping broadcast message larger than %s bytes", self.MAX_PAYLOAD)
+            return
+        await self._conn.execute("SELECT pg_notify($1, $2)", self.pg_channel, data)
+
+def create_broadcast(url: str) -> Broadcast:
+    """
+    Build a broadcast backend from a URL
+
+    memory://                  single worker, in-process only
+    unix:///path/to/directory  workers on the same host
+    postgres://user@host/db    workers across hosts via LISTEN/NOTIFY
+    """
+    parsed = urlparse(url or "memory://")
+
+    if parsed.scheme in ("", "memory"):
+        return Broadcast()
+    if parsed.scheme == "unix":
+        return UnixSocketBroadcast(parsed.path or "/tmp/platform-hub-broadcast")
+    if parsed.scheme in ("postgres", "postgresql"):
+        return PostgresBroadcast(url)
+
+    raise ValueError(f"Unsupported broadcast URL scheme: {parsed.scheme}")
+
+broadcast = create_broadcast(get_settings().broadcast_url)
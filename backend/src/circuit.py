@@ -0,0 +1,226 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+class DependencyUnavailable(Exception):
+    """A backing service failed and there is no stale copy to serve instead"""
+
+    def __init__(self, name: str, retry_after: int = 5, reason: Optional[str] = None):
+        super().__init__(reason or f"{name} is unavailable")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitOpenError(DependencyUnavailable):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+class CircuitBreaker:
+    """
+    Fail fast while a dependency is unhealthy
+
+    The outcomes of the last `window` calls are kept; once at least
+    `min_calls` are recorded and the share of failed or slow calls reaches
+    `failure_rate`, the circuit opens and calls raise CircuitOpenError
+    without touching the dependency. After `open_seconds` a single trial
+    call is let through (half-open): success closes the circuit, failure
+    opens it again. Exceptions for which `is_failure` returns False (bad
+    input rather than an unhealthy dependency) count as successes. With
+    `slow_call_seconds` None only errors count.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        slow_call_seconds: Optional[float] = 2.0,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        is_failure: Optional[Callable[[Exception], bool]] = None
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.is_failure = is_failure or (lambda exc: True)
+
+        self.state = self.CLOSED
+        self.opened_at: Optional[float] = None
+        self.rejected = 0
+        self.trips = 0
+        self._outcomes: deque = deque(maxlen=window)
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are being rejected"""
+        with self._lock:
+            return self.state == self.OPEN and not self._cooled_down()
+
+    def retry_after(self) -> int:
+        """Seconds until the next trial call is allowed"""
+        if self.opened_at is None:
+            return 0
+        return max(1, int(self.opened_at + self.open_seconds - time.monotonic()) + 1)
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.open_seconds
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and self._cooled_down():
+                self.state = self.HALF_OPEN
+                logger.info("Circuit %s half-open, sending a trial call", self.name)
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(self.name, self.retry_after(), f"{self.name} circuit is open")
+
+    def record(self, duration: float, failed: bool):
+        """Record the outcome of a call that went through"""
+        bad = failed or (self.slow_call_seconds is not None and duration >= self.slow_call_seconds)
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_running = False
+                if bad:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self.opened_at = None
+                    self._outcomes.clear()
+                    logger.info("Circuit %s closed", self.name)
+                return
+
+            self._outcomes.append(bad)
+            if self.state == self.CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def _abandon(self):
+        # A call that was cancelled says nothing about the dependency
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_running = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._outcomes.clear()
+        logger.warning("Circuit %s opened for %.0fs", self.name, self.open_seconds)
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call func through the breaker"""
+        self.before_call()
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(time.monotonic() - started, failed=self.is_failure(e))
+            raise
+        except BaseException:
+            self._abandon()
+            raise
+        self.record(time.monotonic() - started, failed=False)
+        return result
+
+    async def call_async(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Await func through the breaker"""
+        self.before_call()
+        started = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record(time.monotonic() - started, failed=self.is_failure(e))
+            raise
+        except BaseException:
+            self._abandon()
+            raise
+        self.record(time.monotonic() - started, failed=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return {
+            "state": self.state,
+            "recent_calls": len(outcomes),
+            "recent_failures": sum(outcomes),
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after() if self.state != self.CLOSED else 0
+        }
+
+def create_breaker(
+    name: str,
+    is_failure: Optional[Callable[[Exception], bool]] = None,
+    count_slow_calls: bool = True
+) -> CircuitBreaker:
+    """Build a breaker with the thresholds from settings"""
+    settings = get_settings()
+    return CircuitBreaker(
+        name,
+        failure_rate=settings.circuit_failure_rate,
+        slow_call_seconds=settings.circuit_slow_call_seconds if count_slow_calls else None,
+        window=settings.circuit_window,
+        min_calls=settings.circuit_min_calls,
+        open_seconds=settings.circuit_open_seconds,
+        is_failure=is_failure
+    )
+
+# Age in seconds of the oldest stale data used for the current request, if any
+_stale_age_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stale_age", default=None)
+
+def note_stale(age_seconds: float):
+    """Record that the current request is being answered from stale data"""
+    holder = _stale_age_var.get()
+    if holder is not None:
+        holder["age"] = max(holder.get("age", 0.0), age_seconds)
+
+class StaleResponseMiddleware:
+    """
+    ASGI middleware adding Age and X-Cache-Status: stale to responses built from stale data
+
+    The holder is a mutable dict so that notes made in worker threads (which
+    run with a copy of the context) still reach the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        holder: Dict[str, float] = {}
+        token = _stale_age_var.set(holder)
+
+        async def send_with_age(message):
+            if message["type"] == "http.response.start" and "age" in holder:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"age", str(int(holder["age"])).encode()),
+                    (b"x-cache-status", b"stale")
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_age)
+        finally:
+            _stale_age_var.reset(token)
@@ -0,0 +1,145 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+
+class Settings(BaseModel):
+    """Application settings read from the environment"""
+    # Authentication
+    jwt_secret_key: Optional[str] = None
+    jwt_algorithm: str = "HS256"
+    jwt_access_token_expire_minutes: int = 30
+
+    # Supabase
+    supabase_url: Optional[str] = None
+    supabase_key: Optional[str] = None
+
+    # GitHub
+    github_token: Optional[str] = None
+    github_repo: str = "yourusername/your-repo-name"
+    github_workflow_id: str = "terraform-deploy.yml"
+
+    # Webhooks
+    webhook_secret: Optional[str] = None
+
+    # Cross-worker events: memory://, unix:///path or postgres://...
+    broadcast_url: str = "memory://"
+
+    # Scheduler leader lease: memory://, file:///path or supabase://
+    scheduler_lease_url: str = "memory://"
+
+    # Admission control for provisioning endpoints
+    admission_user_per_minute: float = 10
+    admission_user_burst: float = 5
+    admission_env_per_minute: str = "dev=30,staging=20,prod=5"
+    admission_max_in_flight: int = 4
+    admission_queue_timeout: float = 10.0
+
+    # Request profiling
+    profile_sample_rate: float = 0.0
+    profile_buffer_size: int = 50
+    profile_interval_ms: float = 1.0
+
+    # Logging
+    log_level: str = "INFO"
+    log_format: str = "json"
+    log_debug_sample_rate: float = 0.1
+
+    # Retention: finished deployments older than this move to the archive
+    # (0 disables; archiving also needs archive_url, as archived fields are removed from the table)
+    archive_retention_days: int = 0
+    archive_batch_size: int = 500
+    archive_interval_seconds: int = 3600
+    archive_url: str = ""
+
+    # Circuit breakers around Supabase and GitHub
+    circuit_failure_rate: float = 0.5
+    circuit_slow_call_seconds: float = 2.0
+    circuit_window: int = 20
+    circuit_min_calls: int = 5
+    circuit_open_seconds: float = 30.0
+    supabase_timeout_seconds: float = 10.0
+    # How long past expiry a cached deployment may be served during an outage
+    cache_stale_seconds: int = 3600
+
+    # Deployment WebSockets
+    ws_max_connections: int = 1000
+    ws_max_per_user: int = 10
+    ws_queue_size: int = 32
+    ws_heartbeat_interval: float = 20.0
+    ws_heartbeat_timeout: float = 60.0
+    ws_idle_timeout: float = 1800.0
+    ws_send_timeout: float = 10.0
+
+    # Traffic recording for load replay (off unless a path is set)
+    record_traffic_path: Optional[str] = None
+
+    # Security group rule policy: ports that may be open to 0.0.0.0/0 per environment ("*" for any)
+    sg_world_open_ports: str = "dev=*,staging=*,prod=80;443"
+    sg_max_rules: int = 60
+
+    # Startup warm-up
+    warmup_enabled: bool = True
+    warmup_deployments: int = 50
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    """Load the .env file and environment once and return the settings"""
+    load_dotenv()
+
+    return Settings(
+        jwt_secret_key=os.getenv("JWT_SECRET_KEY"),
+        jwt_algorithm=os.getenv("JWT_ALGORITHM", "HS256"),
+        jwt_access_token_expire_minutes=int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30")),
+        supabase_url=os.getenv("SUPABASE_URL"),
+        supabase_key=os.getenv("SUPABASE_KEY"),
+        github_token=os.getenv("GITHUB_TOKEN"),
+        github_repo=os.getenv("GITHUB_REPO", "yourusername/your-repo-name"),
+        # WORKFLOW_ID is the name documented in .env.example
+        github_workflow_id=os.getenv("GITHUB_WORKFLOW_ID") or os.getenv("WORKFLOW_ID", "terraform-deploy.yml"),
+        webhook_secret=os.getenv("WEBHOOK_SECRET"),
+        broadcast_url=os.getenv("BROADCAST_URL", "memory://"),
+        scheduler_lease_url=os.getenv("SCHEDULER_LEASE_URL", "memory://"),
+        admission_user_per_minute=float(os.getenv("ADMISSION_USER_PER_MINUTE", "10")),
+        admission_user_burst=float(os.getenv("ADMISSION_USER_BURST", "5")),
+        admission_env_per_minute=os.getenv("ADMISSION_ENV_PER_MINUTE", "dev=30,staging=20,prod=5"),
+        admission_max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "4")),
+        admission_queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+        profile_sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+        profile_buffer_size=int(os.getenv("PROFILE_BUFFER_SIZE", "50")),
+        profile_interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "1")),
+        log_level=os.getenv("LOG_LEVEL", "INFO"),
+        log_format=os.getenv("LOG_FORMAT", "json"),
+        log_debug_sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1")),
+        archive_retention_days=int(os.getenv("ARCHIVE_RETENTION_DAYS", "0")),
+        archive_batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "500")),
+        archive_interval_seconds=int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600")),
+        archive_url=os.getenv("ARCHIVE_URL", ""),
+        circuit_failure_rate=float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5")),
+        circuit_slow_call_seconds=float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "2")),
+        circuit_window=int(os.getenv("CIRCUIT_WINDOW", "20")),
+        circuit_min_calls=int(os.getenv("CIRCUIT_MIN_CALLS", "5")),
+        circuit_open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+        supabase_timeout_seconds=float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "10")),
+        cache_stale_seconds=int(os.getenv("CACHE_STALE_SECONDS", "3600")),
+        ws_max_connections=int(os.getenv("WS_MAX_CONNECTIONS", "1000")),
+        ws_max_per_user=int(os.getenv("WS_MAX_PER_USER", "10")),
+        ws_queue_size=int(os.getenv("WS_QUEUE_SIZE", "32")),
+        ws_heartbeat_interval=float(os.getenv("WS_HEARTBEAT_INTERVAL", "20")),
+        ws_heartbeat_timeout=float(os.getenv("WS_HEARTBEAT_TIMEOUT", "60")),
+        ws_idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", "1800")),
+        ws_send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10")),
+        record_traffic_path=os.getenv("RECORD_TRAFFIC_PATH") or None,
+        sg_world_open_ports=os.getenv("SG_WORLD_OPEN_PORTS", "dev=*,staging=*,prod=80;443"),
+        sg_max_rules=int(os.getenv("SG_MAX_RULES", "60")),
+        warmup_enabled=_env_bool("WARMUP_ENABLED", "true"),
+        warmup_deployments=int(os.getenv("WARMUP_DEPLOYMENTS", "50")),
+    )
@@ -0,0 +1,378 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from src.archive import FINISHED_STATUSES
+from src.broadcast import broadcast, DEPLOYMENTS_CHANNEL
+from src.circuit import DependencyUnavailable
+from src.config import get_settings
+from src import supabase
+
+logger = logging.getLogger(__name__)
+
+# Close codes sent to clients (RFC 6455 section 7.4.1)
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# Message types where only the latest queued message matters
+COALESCED_TYPES = ("status_update", "ping")
+
+def _status_message(deployment: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "status_update",
+        "data": {
+            "deployment_id": deployment.get("id"),
+            "status": deployment.get("status"),
+            "outputs": deployment.get("outputs", {})
+        }
+    }
+
+def _finished_message(deployment: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "deployment_finished",
+        "data": {
+            "status": deployment.get("status"),
+            "completed_at": deployment.get("completed_at")
+        }
+    }
+
+class Connection:
+    """
+    One accepted WebSocket and its bounded send queue
+
+    send() never waits: queued status updates and pings are replaced by
+    newer ones, and when the queue is full the oldest message is dropped.
+    A single writer drains the queue with a timeout per send, so a slow
+    client holds at most `queue_size` messages and is closed rather than
+    stalling anyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, key: str, deployment_id: str, queue_size: int):
+        self.websocket = websocket
+        self.key = key
+        self.deployment_id = deployment_id
+        self.queue_size = queue_size
+
+        self.close_code: Optional[int] = None
+        self.close_reason = ""
+        self.dropped = 0
+        self.last_received = time.monotonic()
+        self.last_activity = self.last_received
+        self._queue: deque = deque()
+        self._wakeup = asyncio.Event()
+
+    def send(self, message: Dict[str, Any]):
+        """Queue a message for the client without waiting"""
+        if self.close_code is not None:
+            return
+
+        if message.get("type") != "ping":
+            self.last_activity = time.monotonic()
+
+        if message.get("type") in COALESCED_TYPES:
+            for index, queued in enumerate(self._queue):
+                if queued.get("type") == message["type"]:
+                    self._queue[index] = message
+                    return
+
+        if len(self._queue) >= self.queue_size:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(message)
+        self._wakeup.set()
+
+    def close(self, code: int = CLOSE_NORMAL, reason: str = ""):
+        """Close once the messages already queued are sent"""
+        if self.close_code is None:
+            self.close_code = code
+            self.close_reason = reason
+        self._wakeup.set()
+
+    async def write(self, send_timeout: float):
+        """Send queued messages until close() is called"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue:
+                try:
+                    await asyncio.wait_for(self.websocket.send_json(self._queue.popleft()), send_timeout)
+                except asyncio.TimeoutError:
+                    self._queue.clear()
+                    self.close(CLOSE_POLICY, "Client too slow")
+                    return
+            if self.close_code is not None:
+                return
+
+    async def read(self):
+        """Consume client messages (pongs) until the client disconnects"""
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            self.last_received = time.monotonic()
+
+class DeploymentWatch:
+    """The connections following one deployment, sharing a single watcher task"""
+
+    def __init__(self, deployment: Dict[str, Any]):
+        self.deployment = deployment
+        self.connections: Set[Connection] = set()
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def on_deployment_event(self, message: Dict[str, Any]):
+        if message.get("deployment_id") == self.deployment.get("id"):
+            self.changed.set()
+
+    def fan_out(self, message: Dict[str, Any]):
+        for connection in self.connections:
+            connection.send(message)
+
+    def close_all(self, code: int = CLOSE_NORMAL, reason: str = ""):
+        for connection in self.connections:
+            connection.close(code, reason)
+
+class ConnectionManager:
+    """
+    Tracks every deployment WebSocket on this worker
+
+    Connections are admitted against a global and a per-user limit. Each
+    deployment has one watcher that re-fetches it on broadcast events (or
+    every `poll_interval` seconds) and fans updates out to its connections,
+    and one sweeper pings every connection, closing those that stopped
+    answering or saw no update for `idle_timeout`. drain() closes all
+    connections with 1001 so clients reconnect to another worker.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 1000,
+        max_per_user: int = 10,
+        queue_size: int = 32,
+        heartbeat_interval: float = 20.0,
+        heartbeat_timeout: float = 60.0,
+        idle_timeout: float = 1800.0,
+        send_timeout: float = 10.0,
+        poll_interval: float = 3.0
+    ):
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.poll_interval = poll_interval
+
+        self.draining = False
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.closed: Dict[str, int] = defaultdict(int)
+        self._connections: Set[Connection] = set()
+        self._by_key: Dict[str, Set[Connection]] = defaultdict(set)
+        self._watches: Dict[str, DeploymentWatch] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def __len__(self):
+        return len(self._connections)
+
+    async def start(self):
+        self.draining = False
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def drain(self, timeout: float = 5.0):
+        """Stop accepting connections and close the open ones, waiting up to timeout"""
+        self.draining = True
+        for connection in list(self._connections):
+            connection.close(CLOSE_GOING_AWAY, "Server shutting down")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%s WebSocket connections still open after drain", len(self._connections))
+
+        tasks = [watch.task for watch in self._watches.values() if watch.task]
+        if self._sweeper is not None:
+            tasks.append(self._sweeper)
+            self._sweeper = None
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def _admit(self, key: str) -> Optional[str]:
+        if self.draining:
+            return "Server shutting down"
+        if len(self._connections) >= self.max_connections:
+            return "Too many connections"
+        if len(self._by_key[key]) >= self.max_per_user:
+            return "Too many connections for this user"
+        return None
+
+    async def serve(self, websocket: WebSocket, deployment_id: str, key: str):
+        """Run a deployment WebSocket from accept to close"""
+        await websocket.accept()
+
+        reason = self._admit(key)
+        if reason:
+            self.rejected += 1
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason=reason)
+            return
+
+        connection = Connection(websocket, key, deployment_id, self.queue_size)
+        self._register(connection)
+        reader = asyncio.create_task(connection.read())
+        try:
+            await self._follow(connection)
+            writer = asyncio.create_task(connection.write(self.send_timeout))
+            done, _ = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+            if writer in done and writer.exception() is None:
+                await websocket.close(code=connection.close_code or CLOSE_NORMAL, reason=connection.close_reason)
+            else:
+                connection.close_reason = connection.close_reason or "Client disconnected"
+                writer.cancel()
+        except Exception as e:
+            logger.warning("WebSocket for deployment %s failed: %s", deployment_id, e)
+            connection.close_reason = connection.close_reason or "Error"
+        finally:
+            reader.cancel()
+            self._unregister(connection)
+
+    async def _follow(self, connection: Connection):
+        # Send the current state, then attach to the deployment's watcher
+        try:
+            deployment = await asyncio.to_thread(supabase.get_deployment, connection.deployment_id)
+        except DependencyUnavailable as e:
+            connection.send({"error": str(e)})
+            connection.close(CLOSE_TRY_AGAIN_LATER, "Database unavailable")
+            return
+
+        if not deployment:
+            connection.send({"error": "Deployment not found"})
+            connection.close(CLOSE_NORMAL, "Deployment not found")
+            return
+
+        connection.send(_status_message(deployment))
+        if deployment.get("status") in FINISHED_STATUSES:
+            connection.send(_finished_message(deployment))
+            connection.close(CLOSE_NORMAL, "Deployment finished")
+            return
+
+        watch = self._watches.get(connection.deployment_id)
+        if watch is None:
+            watch = DeploymentWatch(deployment)
+            self._watches[connection.deployment_id] = watch
+            watch.task = asyncio.create_task(self._watch(connection.deployment_id, watch))
+        watch.connections.add(connection)
+
+    async def _watch(self, deployment_id: str, watch: DeploymentWatch):
+        broadcast.subscribe(DEPLOYMENTS_CHANNEL, watch.on_deployment_event)
+        try:
+            while watch.connections:
+                # Re-fetch on a broadcast event, or every poll_interval seconds as a fallback
+                try:
+                    await asyncio.wait_for(watch.changed.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                watch.changed.clear()
+
+                try:
+                    current = await asyncio.to_thread(supabase.get_deployment, deployment_id)
+                except DependencyUnavailable:
+                    # Keep sockets open through a database outage
+                    continue
+
+                if not current:
+                    watch.fan_out({"error": "Deployment no longer exists"})
+                    watch.close_all(CLOSE_NORMAL, "Deployment no longer exists")
+                    return
+
+                if current.get("status") != watch.deployment.get("status"):
+                    watch.fan_out(_status_message(current))
+                    if current.get("status") in FINISHED_STATUSES:
+                        watch.fan_out(_finished_message(current))
+                        watch.close_all(CLOSE_NORMAL, "Deployment finished")
+                        return
+                watch.deployment = current
+        except Exception as e:
+            logger.error("Error watching deployment %s: %s", deployment_id, e)
+            watch.fan_out({"error": str(e)})
+            watch.close_all(CLOSE_TRY_AGAIN_LATER, "Error")
+        finally:
+            broadcast.unsubscribe(DEPLOYMENTS_CHANNEL, watch.on_deployment_event)
+            if self._watches.get(deployment_id) is watch:
+                del self._watches[deployment_id]
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for connection in list(self._connections):
+                if now - connection.last_received > self.heartbeat_timeout:
+                    connection.close(CLOSE_GOING_AWAY, "Heartbeat timeout")
+                elif now - connection.last_activity > self.idle_timeout:
+                    connection.close(CLOSE_NORMAL, "Idle timeout")
+                else:
+                    connection.send({"type": "ping"})
+
+    def _register(self, connection: Connection):
+        self._connections.add(connection)
+        self._by_key[connection.key].add(connection)
+        self.accepted += 1
+        self._idle.clear()
+
+    def _unregister(self, connection: Connection):
+        self._connections.discard(connection)
+        connections = self._by_key.get(connection.key)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._by_key[connection.key]
+
+        watch = self._watches.get(connection.deployment_id)
+        if watch is not None:
+            watch.connections.discard(connection)
+            if not watch.connections:
+                del self._watches[connection.deployment_id]
+                if watch.task is not None:
+                    watch.task.cancel()
+
+        self.dropped += connection.dropped
+        self.closed[connection.close_reason or "Closed"] += 1
+        if not self._connections:
+            self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self._connections),
+            "users": len(self._by_key),
+            "watched_deployments": len(self._watches),
+            "queued_messages": sum(len(connection._queue) for connection in self._connections),
+            "dropped_messages": self.dropped + sum(connection.dropped for connection in self._connections),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "closed": dict(self.closed),
+            "draining": self.draining
+        }
+
+def _create_manager() -> ConnectionManager:
+    settings = get_settings()
+    return ConnectionManager(
+        max_connections=settings.ws_max_connections,
+        max_per_user=settings.ws_max_per_user,
+        queue_size=settings.ws_queue_size,
+        heartbeat_interval=settings.ws_heartbeat_interval,
+        heartbeat_timeout=settings.ws_heartbeat_timeout,
+        idle_timeout=settings.ws_idle_timeout,
+        send_timeout=settings.ws_send_timeout
+    )
+
+connections = _create_manager()
@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+from typing import Any, Dict, Iterator, Optional
+
+from src.archive import hydrate
+from src import supabase
+
+# Columns written to exports, in CSV column order
+EXPORT_FIELDS = [
+    "id", "name", "resource_type", "status", "environment", "region",
+    "created_at", "completed_at", "error_message", "requested_by", "parameters", "outputs"
+]
+
+# Columns fetched from the table; logs are only fetched when requested
+_COLUMNS = ",".join(EXPORT_FIELDS + ["archived_segment"])
+
+# Filters accepted by the export, matching the Dashboard list filters
+EXPORT_FILTERS = ["status", "resource_type", "environment"]
+
+def _rows(filters: Dict[str, str], include_logs: bool, page_size: int) -> Iterator[Dict[str, Any]]:
+    # Only one page is held in memory at a time
+    columns = f"{_COLUMNS},logs" if include_logs else _COLUMNS
+    for page in supabase.iter_deployment_pages(page_size, columns, filters):
+        for deployment in page:
+            deployment = hydrate(deployment)
+            row = {field: deployment.get(field) for field in EXPORT_FIELDS}
+            if include_logs:
+                row["logs"] = deployment.get("logs") or []
+            yield row
+
+def export_ndjson(filters: Dict[str, str], include_logs: bool = False, page_size: int = 500) -> Iterator[str]:
+    """Yield one JSON document per deployment"""
+    for row in _rows(filters, include_logs, page_size):
+        yield json.dumps(row, default=str) + "\n"
+
+def export_csv(filters: Dict[str, str], include_logs: bool = False, page_size: int = 500) -> Iterator[str]:
+    """Yield a CSV header and one line per deployment; nested values are JSON-encoded"""
+    fields = EXPORT_FIELDS + (["logs"] if include_logs else [])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return value
+
+    writer.writerow(fields)
+    yield flush()
+
+    for row in _rows(filters, include_logs, page_size):
+        writer.writerow([
+            json.dumps(row.get(field), default=str) if isinstance(row.get(field), (dict, list)) else row.get(field)
+            for field in fields
+        ])
+        yield flush()
+
+def export_filters(**values: Optional[str]) -> Dict[str, str]:
+    """Keep only the supported filters that were given"""
+    return {field: values[field] for field in EXPORT_FILTERS if values.get(field)}
@@ -1,16 +1,50 @@
 # src/github_api.py
-import os
 import httpx
 import json
-from typing import Dict, Any
-from dotenv import load_dotenv
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Any, Optional
 
-load_dotenv()
+from src.circuit import create_breaker, CircuitOpenError
+from src.config import get_settings
+from src.security_groups import normalize_ingress_rules
+from src.supabase import save_deployment, queue_deployment_save, breaker as supabase_breaker
+
+logger = logging.getLogger(__name__)
 
 # GitHub configuration
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-GITHUB_REPO = os.getenv("GITHUB_REPO", "yourusername/your-repo-name")
-WORKFLOW_ID = os.getenv("GITHUB_WORKFLOW_ID", "terraform-deploy.yml")
+_settings = get_settings()
+GITHUB_TOKEN = _settings.github_token
+GITHUB_REPO = _settings.github_repo
+WORKFLOW_ID = _settings.github_workflow_id
+
+# Shared HTTP client so dispatches reuse pooled connections to api.github.com
+_http_client: Optional[httpx.AsyncClient] = None
+
+class GitHubServerError(Exception):
+    """GitHub answered with a 5xx status"""
+
+# Only transport errors, timeouts and 5xx responses count against GitHub's health
+breaker = create_breaker("github")
+
+def init_http_client() -> httpx.AsyncClient:
+    """Create the shared GitHub HTTP client if it does not exist yet"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url="https://api.github.com",
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+        )
+    return _http_client
+
+async def close_http_client():
+    """Close the shared GitHub HTTP client on shutdown"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 async def trigger_infrastructure_deployment(
     resource_type: str,
@@ -93,6 +127,9 @@ async def trigger_infrastructure_deployment(
             "vpc_id": deployment_params.get("vpc_id", "vpc-default"),
             "ingress_rules": deployment_params.get("ingress_rules", [{"from_port":80,"to_port":80,"protocol":"tcp","cidr_blocks":["0.0.0.0/0"],"description":"HTTP"}])
         })
+        # Merge duplicates, drop shadowed rules and enforce the environment's policy before a runner is used
+        config["ingress_rules"] = normalize_ingress_rules(config["ingress_rules"], environment)
+        deployment_params["ingress_rules"] = config["ingress_rules"]
         
     # Add config JSON to inputs
     inputs["config_json"] = json.dumps(config)
@@ -110,25 +147,30 @@ async def trigger_infrastructure_deployment(
         "Content-Type": "application/json"
     }
     
-    # Trigger the workflow via GitHub API
-    async with httpx.AsyncClient() as client:
+    # A deployment that cannot be recorded must not be started, so refuse while Supabase is down
+    if supabase_breaker.is_open:
+        raise CircuitOpenError("supabase", supabase_breaker.retry_after(), "supabase circuit is open")
+
+    # Trigger the workflow via GitHub API, failing fast while GitHub is unhealthy
+    client = init_http_client()
+
+    async def dispatch() -> httpx.Response:
         response = await client.post(
-            f"https://api.github.com/repos/{GITHUB_REPO}/actions/workflows/{WORKFLOW_ID}/dispatches",
+            f"/repos/{GITHUB_REPO}/actions/workflows/{WORKFLOW_ID}/dispatches",
             headers=headers,
             json=payload
         )
+        if response.status_code >= 500:
+            raise GitHubServerError(f"Failed to trigger workflow: {response.status_code} - {response.text}")
+        return response
+
+    response = await breaker.call_async(dispatch)
     
     if response.status_code == 204:
         # Generate a deployment ID (GitHub doesn't return one)
-        from datetime import datetime
-        import uuid
-        
         deployment_id = f"deploy-{int(datetime.now().timestamp())}-{uuid.uuid4().hex[:8]}"
         
-        # Save deployment in database
-        from src.supabase import save_deployment
-        
-        save_deployment({
+        deployment = {
             "id": deployment_id,
             "resource_type": resource_type,
             "name": name,
@@ -137,7 +179,15 @@ async def trigger_infrastructure_deployment(
             "status": "pending",
             "parameters": {**inputs, **deployment_params},
             "created_at": datetime.utcnow().isoformat()
-        })
+        }
+        
+        # Save deployment in database; the workflow is already running, so a failed
+        # save is queued for later instead of failing a request that a client would retry
+        try:
+            save_deployment(deployment)
+        except Exception as e:
+            logger.error("Deployment %s was dispatched but not saved, queued for retry: %s", deployment_id, e)
+            queue_deployment_save(deployment)
         
         return {
             "deployment_id": deployment_id,
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from src.broadcast import broadcast
+from src.config import get_settings
+from src import github_api, supabase
+
+logger = logging.getLogger(__name__)
+
+# Monotonic reference for cold-start measurement, taken when the app modules are imported
+PROCESS_STARTED = time.perf_counter()
+
+class Lifecycle:
+    """Tracks client initialisation, cache warm-up and readiness of the API process"""
+
+    def __init__(self):
+        self.ready = False
+        self.clients_ready = False
+        self.startup_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.warmed_deployments = 0
+        self.last_error: Optional[str] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+
+    async def startup(self):
+        """Create clients and schedule the warm-up without blocking on the network"""
+        settings = get_settings()
+
+        try:
+            supabase.init_client()
+            github_api.init_http_client()
+            self.clients_ready = True
+        except Exception as e:
+            # Stay up for /api/health; /api/ready reports the problem
+            self.last_error = str(e)
+            logger.error("Error initialising clients: %s", e)
+
+        try:
+            await broadcast.connect()
+        except Exception as e:
+            # Without a transport this worker still serves, only without peer updates
+            self.last_error = str(e)
+            logger.error("Error connecting broadcast backend: %s", e)
+
+        self.startup_seconds = time.perf_counter() - PROCESS_STARTED
+        logger.info("Startup completed in %.3fs", self.startup_seconds)
+
+        if self.clients_ready:
+            self._warmup_task = asyncio.create_task(self.warm_up(settings.warmup_enabled, settings.warmup_deployments))
+
+    async def warm_up(self, enabled: bool = True, limit: int = 50, max_delay: float = 30.0):
+        """Pre-load recent deployments, retrying with backoff until the database answers"""
+        started = time.perf_counter()
+        delay = 1.0
+
+        while enabled:
+            try:
+                self.warmed_deployments = await asyncio.to_thread(supabase.warm_deployment_cache, limit)
+                self.last_error = None
+                break
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Warm-up failed, retrying in %.0fs: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+        self.warmup_seconds = time.perf_counter() - started
+        self.ready = True
+        logger.info(
+            "Warm-up completed in %.3fs (%s deployments cached)",
+            self.warmup_seconds, self.warmed_deployments
+        )
+
+    async def shutdown(self):
+        """Cancel a pending warm-up and release clients"""
+        self.ready = False
+
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+            try:
+                await self._warmup_task
+            except asyncio.CancelledError:
+                pass
+
+        if broadcast.connected:
+            await broadcast.disconnect()
+        await github_api.close_http_client()
+        supabase.close_client()
+        self.clients_ready = False
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness details for the /api/ready endpoint"""
+        return {
+            "status": "ready" if self.ready else "starting",
+            "clients_ready": self.clients_ready,
+            "broadcast": type(broadcast).__name__ if broadcast.connected else None,
+            "startup_seconds": self.startup_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warmed_deployments": self.warmed_deployments,
+            "last_error": self.last_error
+        }
+
+lifecycle = Lifecycle()
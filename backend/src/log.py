@@ -0,0 +1,193 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from src.config import get_settings
+
+# Correlation ids attached to every record emitted while they are set
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+deployment_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("deployment_id", default=None)
+
+# Keys whose values never reach the log output
+_SENSITIVE_KEYS = re.compile(r"secret|token|password|authorization|api_key|supabase_key", re.IGNORECASE)
+
+# Credentials that may appear inside free text
+_SENSITIVE_TEXT = [
+    (re.compile(r"\b(gh[pousr]_[A-Za-z0-9]{20,}|github_pat_[A-Za-z0-9_]{20,})"), "[REDACTED]"),
+    (re.compile(r"((?:token|bearer)\s+)[A-Za-z0-9._\-]{16,}", re.IGNORECASE), r"\1[REDACTED]"),
+    (re.compile(r"""(["']?(?:secret|password|token)["']?\s*[:=]\s*["']?)[^"',\s}]+""", re.IGNORECASE), r"\1[REDACTED]")
+]
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+def redact(value: Any) -> Any:
+    """Return a copy of value with sensitive keys and embedded credentials masked"""
+    if isinstance(value, dict):
+        return {
+            key: "[REDACTED]" if isinstance(key, str) and _SENSITIVE_KEYS.search(key) else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, str):
+        for pattern, replacement in _SENSITIVE_TEXT:
+            value = pattern.sub(replacement, value)
+    return value
+
+def bind_deployment(deployment_id: Optional[str]):
+    """Attach a deployment id to the log records of the current request or task"""
+    deployment_id_var.set(deployment_id)
+
+class ContextFilter(logging.Filter):
+    """Copy correlation ids onto the record in the thread that logged it"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        if not hasattr(record, "deployment_id"):
+            record.deployment_id = deployment_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG records; other levels always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with secrets redacted"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if record.args:
+            record.args = redact(record.args) if isinstance(record.args, dict) else tuple(redact(list(record.args)))
+
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+            "request_id": getattr(record, "request_id", None),
+            "deployment_id": getattr(record, "deployment_id", None)
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and key not in entry:
+                entry[key] = redact(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+class RedactingFormatter(logging.Formatter):
+    """Plain text output for local development, with secrets redacted"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if record.args:
+            record.args = redact(record.args) if isinstance(record.args, dict) else tuple(redact(list(record.args)))
+        return redact(super().format(record))
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread
+
+    The stdlib QueueHandler renders the message in the calling thread; here
+    the record is only copied, so interpolation, redaction and JSON encoding
+    all happen off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        if record.args and not isinstance(record.args, dict):
+            record.args = tuple(record.args)
+        return record
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging():
+    """Route all logging through a queue drained by a background writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    settings = get_settings()
+
+    output = logging.StreamHandler(sys.stdout)
+    if settings.log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(RedactingFormatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s %(deployment_id)s] %(message)s"
+        ))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(settings.log_debug_sample_rate))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.log_level.upper())
+
+    # Send uvicorn's own loggers through the same pipeline
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class RequestContextMiddleware:
+    """ASGI middleware giving each request an id, taken from X-Request-ID when present"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        request_token = request_id_var.set(request_id)
+        deployment_token = deployment_id_var.set(None)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(request_token)
+            deployment_id_var.reset(deployment_token)
@@ -1,21 +1,59 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Form, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, status, Form, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 import uvicorn
-import os
-import asyncio
+import logging
 from typing import List, Optional, Dict, Any
 from datetime import timedelta, datetime
 
 # Import modules - fixed imports
+from src.log import configure_logging, shutdown_logging, bind_deployment, RequestContextMiddleware
+from src.lifecycle import lifecycle
+from src.config import get_settings
+from src.connections import connections
 from src.auth import verify_token, get_current_user, create_access_token, authenticate_user, User, ACCESS_TOKEN_EXPIRE_MINUTES
 from src.terraform import execute_terraform
+from src.github_api import trigger_infrastructure_deployment
+from src import github_api, supabase
+from src.admission import admission, AdmissionRejected, UnknownEnvironment
+from src.archive import archive_finished_deployments, hydrate
+from src.broadcast import broadcast, DEPLOYMENTS_CHANNEL
+from src.circuit import DependencyUnavailable, StaleResponseMiddleware
+from src.export import export_csv, export_ndjson, export_filters
+from src.profiling import profiler, collapsed, ProfilingMiddleware
+from src.recorder import recorder, RecordingMiddleware
+from src.scheduler import scheduler
+from src.search import search_index, QueryTooBroad
+from src.security_groups import analyze_ingress_rules, InvalidSecurityGroupRules
+from src.supabase import get_deployments, get_deployment, get_deployments_bulk, save_deployment, update_deployment, update_stalled_deployments, refresh_stale_deployments, save_pending_deployments
 from passlib.context import CryptContext
 
+logger = logging.getLogger(__name__)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-app = FastAPI(title="Infrastructure Provisioning API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create clients, warm caches and start background tasks; tear them down on shutdown"""
+    # Started here rather than at import so importing the app has no side effects
+    configure_logging()
+    await lifecycle.startup()
+    await scheduler.start()
+    await search_index.start()
+    await connections.start()
+    yield
+    await connections.drain()
+    await search_index.stop()
+    await scheduler.stop()
+    await lifecycle.shutdown()
+    if recorder is not None:
+        recorder.close()
+    shutdown_logging()
+
+app = FastAPI(title="Infrastructure Provisioning API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -26,6 +64,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Admin-only request profiling; a pass-through unless requested or sampled
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Age headers on responses served from stale cache during an outage
+app.add_middleware(StaleResponseMiddleware)
+
+# Opt-in traffic recording for load replay; outside the others so timings include them
+if recorder is not None:
+    app.add_middleware(RecordingMiddleware, recorder=recorder)
+
+# Request ids for structured logs; added last so it wraps everything else
+app.add_middleware(RequestContextMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(UnknownEnvironment)
+async def unknown_environment_handler(request, exc: UnknownEnvironment):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"detail": str(exc)}
+    )
+
+@app.exception_handler(DependencyUnavailable)
+async def dependency_unavailable_handler(request, exc: DependencyUnavailable):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(InvalidSecurityGroupRules)
+async def invalid_security_group_rules_handler(request, exc: InvalidSecurityGroupRules):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"detail": "Invalid security group rules", "errors": exc.errors}
+    )
+
 # Models
 class User(BaseModel):
     username: str
@@ -54,6 +135,17 @@ class DeploymentResponse(BaseModel):
     status: str
     message: str
 
+class ProfilingSettings(BaseModel):
+    sample_rate: float
+
+class SnapshotsRequest(BaseModel):
+    ids: List[str]
+    include_logs: bool = False
+
+class SecurityGroupRulesRequest(BaseModel):
+    environment: str
+    ingress_rules: List[Dict[str, Any]]
+
 # Helper function to verify passwords
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -71,7 +163,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["username"]}, 
+        data={"sub": user["username"], "role": user["role"], "email": user.get("email")},
         expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
@@ -80,6 +172,97 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/ready")
+def readiness_check():
+    """Report ready only once clients are initialised and caches are warm"""
+    readiness = lifecycle.status()
+    if not lifecycle.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=readiness)
+    return readiness
+
+def require_admin(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin role required"
+        )
+    return current_user
+
+@app.get("/api/admin/jobs")
+async def get_scheduled_jobs(current_user: User = Depends(require_admin)):
+    """Run statistics for background jobs on this instance"""
+    return {"holder": scheduler.holder, "jobs": scheduler.stats()}
+
+@app.get("/api/admin/admission")
+async def get_admission_stats(current_user: User = Depends(require_admin)):
+    """Admission control counters for provisioning endpoints on this instance"""
+    return admission.stats()
+
+@app.get("/api/admin/websockets")
+async def get_websocket_stats(current_user: User = Depends(require_admin)):
+    """Deployment WebSocket connections on this instance"""
+    return connections.stats()
+
+@app.get("/api/admin/circuits")
+async def get_circuit_stats(current_user: User = Depends(require_admin)):
+    """Circuit breaker state for Supabase (request and background queries) and GitHub on this instance"""
+    return {
+        "supabase": supabase.breaker.stats(),
+        "supabase_background": supabase.background_breaker.stats(),
+        "github": github_api.breaker.stats()
+    }
+
+@app.get("/api/admin/profiles")
+async def list_profiles(current_user: User = Depends(require_admin)):
+    """Recent request profiles, newest first"""
+    return {"sample_rate": profiler.sample_rate, "profiles": profiler.list_profiles()}
+
+@app.get("/api/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str, current_user: User = Depends(require_admin)):
+    """A request profile as collapsed stacks, ready for flamegraph.pl or speedscope"""
+    profile = profiler.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return collapsed(profile)
+
+@app.put("/api/admin/profiling")
+async def update_profiling(settings: ProfilingSettings, current_user: User = Depends(require_admin)):
+    """Set the fraction of requests sampled into the profile buffer (0 disables)"""
+    if not 0 <= settings.sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    profiler.sample_rate = settings.sample_rate
+    return {"sample_rate": profiler.sample_rate}
+
+@app.get("/api/admin/deployments/export")
+async def export_deployments(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    status_filter: Optional[str] = Query(None, alias="status"),
+    resource_type: Optional[str] = None,
+    environment: Optional[str] = None,
+    include_logs: bool = False,
+    current_user: User = Depends(require_admin)
+):
+    """
+    Stream the complete deployment history as NDJSON or CSV
+
+    Rows are fetched page by page as the client reads, so memory stays
+    flat regardless of history size; the sync generator runs in the
+    threadpool and does not block the event loop.
+    """
+    filters = export_filters(status=status_filter, resource_type=resource_type, environment=environment)
+    filename = f"deployments-{datetime.utcnow():%Y%m%dT%H%M%S}.{format}"
+
+    if format == "csv":
+        body, media_type = export_csv(filters, include_logs), "text/csv"
+    else:
+        body, media_type = export_ndjson(filters, include_logs), "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/api/me", response_model=User)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
@@ -95,14 +278,15 @@ async def create_resource(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to provision resources"
         )
-    result = await execute_terraform(
-        resource_type=request.resource_type,
-        params={
-            "size": request.size,
-            "region": request.region,
-            "parameters": request.parameters
-        }
-    )
+    async with admission.admit(current_user.username, request.parameters.get("environment", "dev")) as environment:
+        result = await execute_terraform(
+            resource_type=request.resource_type,
+            params={
+                "size": request.size,
+                "region": request.region,
+                "parameters": {**request.parameters, "environment": environment}
+            }
+        )
     return DeploymentResponse(
         request_id=result["deployment_id"],
         status=result["status"],
@@ -112,24 +296,32 @@ async def create_resource(
 async def get_deployments_endpoint(current_user: User = Depends(get_current_user)):
     """Get all deployments for the current user"""
     # Get deployments from Supabase instead of the in-memory database
-    from src.supabase import get_deployments
-    
     deployments = get_deployments()
     return {"deployments": deployments}
 
-@app.get("/api/deployments/{deployment_id}/status")
-async def get_deployment_status(
-    deployment_id: str,
+@app.get("/api/deployments/search")
+async def search_deployments(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
     current_user: User = Depends(get_current_user)
 ):
-    """Get detailed status of a specific deployment"""
-    from src.supabase import get_deployment
-    
-    deployment = get_deployment(deployment_id)
-    if not deployment:
-        raise HTTPException(status_code=404, detail="Deployment not found")
-    
-    # Return comprehensive deployment information
+    """
+    Search deployments by name, resource type, parameters and outputs
+
+    Examples: `bucket_name:my-bucket`, `container_image:nginx*`,
+    `resource_type:ecs_service environment:prod`, `key:dns_name`.
+    """
+    if not search_index.built:
+        raise HTTPException(status_code=503, detail="Search index is still building")
+    try:
+        found = search_index.search(q, limit, offset)
+    except QueryTooBroad as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"query": q, "limit": limit, "offset": offset, **found}
+
+def deployment_status_payload(deployment: Dict[str, Any]) -> Dict[str, Any]:
+    """Comprehensive deployment information returned by the status endpoints"""
     return {
         "deployment_id": deployment["id"],
         "resource_type": deployment.get("resource_type", ""),
@@ -144,19 +336,8 @@ async def get_deployment_status(
         "error_message": deployment.get("error_message", "")
     }
 
-@app.get("/api/deployments/{deployment_id}/logs")
-async def get_deployment_logs(
-    deployment_id: str,
-    current_user: User = Depends(get_current_user)
-):
-    """Get logs for a specific deployment"""
-    from src.supabase import get_deployment
-    
-    deployment = get_deployment(deployment_id)
-    if not deployment:
-        raise HTTPException(status_code=404, detail="Deployment not found")
-    
-    # Initialize with standard log entries based on status
+def deployment_summary_logs(deployment: Dict[str, Any]) -> List[str]:
+    """Standard log entries derived from the deployment's current status"""
     logs = []
     
     # Add initialization log
@@ -183,13 +364,99 @@ async def get_deployment_logs(
         error_msg = deployment.get("error_message", "Unknown error")
         logs.append(f"Deployment failed: {error_msg}")
     
-    # Get additional logs if stored
-    stored_logs = deployment.get("logs", [])
-    if stored_logs:
-        logs.extend(stored_logs)
+    return logs
+
+@app.get("/api/deployments/{deployment_id}/status")
+async def get_deployment_status(
+    deployment_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get detailed status of a specific deployment"""
+    bind_deployment(deployment_id)
+    deployment = hydrate(get_deployment(deployment_id))
+    if not deployment:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    
+    return deployment_status_payload(deployment)
+
+@app.get("/api/deployments/{deployment_id}/logs")
+async def get_deployment_logs(
+    deployment_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get logs for a specific deployment"""
+    bind_deployment(deployment_id)
+    deployment = hydrate(get_deployment(deployment_id))
+    if not deployment:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    
+    # Standard entries first, then any logs stored by the workflow
+    logs = deployment_summary_logs(deployment)
+    logs.extend(deployment.get("logs") or [])
     
     return {"logs": logs}
 
+@app.get("/api/deployments/{deployment_id}/snapshot")
+async def get_deployment_snapshot(
+    deployment_id: str,
+    after: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Status, outputs and logs of a deployment from a single fetch
+
+    `summary_logs` are the standard status entries and are always complete;
+    `logs` holds the stored workflow logs from position `after` onwards, and
+    `log_sequence` is the value to pass as `after` on the next poll.
+    """
+    bind_deployment(deployment_id)
+    deployment = hydrate(get_deployment(deployment_id))
+    if not deployment:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    
+    stored_logs = deployment.get("logs") or []
+    return {
+        **deployment_status_payload(deployment),
+        "summary_logs": deployment_summary_logs(deployment),
+        "logs": stored_logs[after:],
+        "log_sequence": len(stored_logs)
+    }
+
+@app.post("/api/deployments/snapshots")
+async def get_deployment_snapshots(
+    request: SnapshotsRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Status snapshots for many deployments at once, e.g. for the Dashboard"""
+    if len(request.ids) > 100:
+        raise HTTPException(status_code=400, detail="At most 100 deployment ids per request")
+    
+    deployments, unavailable = get_deployments_bulk(request.ids)
+    
+    snapshots = {}
+    for deployment in deployments:
+        deployment = hydrate(deployment)
+        snapshot = deployment_status_payload(deployment)
+        if request.include_logs:
+            snapshot["summary_logs"] = deployment_summary_logs(deployment)
+            snapshot["logs"] = deployment.get("logs") or []
+            snapshot["log_sequence"] = len(snapshot["logs"])
+        snapshots[deployment["id"]] = snapshot
+    
+    return {
+        "snapshots": snapshots,
+        "missing": [deployment_id for deployment_id in request.ids if deployment_id not in snapshots and deployment_id not in unavailable],
+        "unavailable": unavailable
+    }
+
+@app.post("/api/security-groups/analyze")
+async def analyze_security_group_rules(
+    request: SecurityGroupRulesRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Dry run of the checks applied to security group rules before deployment"""
+    return analyze_ingress_rules(request.ingress_rules, request.environment).to_dict()
+
 @app.post("/api/deployments/create", response_model=DeploymentResponse)
 async def create_deployment(
     request: DeploymentRequest,
@@ -203,43 +470,43 @@ async def create_deployment(
             detail="Not authorized to provision resources"
         )
     
-    try:
-        from src.github_api import trigger_infrastructure_deployment
-        
-        result = await trigger_infrastructure_deployment(
-            resource_type=request.resource_type,
-            name=request.name,
-            environment=request.environment,
-            region=request.region,
-            deployment_params=request.parameters
-        )
-        
-        return DeploymentResponse(
-            request_id=result["deployment_id"],
-            status="pending",
-            message="Deployment initiated successfully"
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
-        )
+    async with admission.admit(current_user.username, request.environment) as environment:
+        try:
+            result = await trigger_infrastructure_deployment(
+                resource_type=request.resource_type,
+                name=request.name,
+                environment=environment,
+                region=request.region,
+                deployment_params=request.parameters
+            )
+        except (DependencyUnavailable, InvalidSecurityGroupRules):
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(e)
+            )
+
+    return DeploymentResponse(
+        request_id=result["deployment_id"],
+        status="pending",
+        message="Deployment initiated successfully"
+    )
 
 @app.post("/api/webhook/deployment")
 async def deployment_webhook(data: dict):
     """Receive deployment updates from GitHub Actions"""
     try:
         # Verify webhook secret
-        webhook_secret = os.getenv("WEBHOOK_SECRET")
+        webhook_secret = get_settings().webhook_secret
         if not webhook_secret or data.get("secret") != webhook_secret:
             raise HTTPException(status_code=403, detail="Invalid webhook secret")
             
         deployment_id = data.get("deployment_id")
         if not deployment_id:
             raise HTTPException(status_code=400, detail="Missing deployment_id")
+        bind_deployment(deployment_id)
             
-        from src.supabase import update_deployment, save_deployment, get_deployment
-        
         # Enhanced error handling for required fields
         for field in ["resource_type", "name", "environment", "region", "status"]:
             if field not in data:
@@ -276,15 +543,20 @@ async def deployment_webhook(data: dict):
             # Update existing deployment
             update_deployment(deployment_id, update_data)
         
-        # Trigger websocket notifications (will be implemented later)
+        # Notify WebSocket watchers on every worker
+        broadcast.publish(DEPLOYMENTS_CHANNEL, {
+            "type": "status_update",
+            "deployment_id": deployment_id,
+            "status": update_data["status"]
+        })
         
         return {"status": "ok", "message": "Webhook processed successfully"}
-    except HTTPException:
-        # Re-raise HTTP exceptions
+    except (HTTPException, DependencyUnavailable):
+        # Re-raise HTTP exceptions; outages become a 503 the workflow can retry
         raise
     except Exception as e:
         # Log error and return 500
-        print(f"Error processing webhook: {str(e)}")
+        logger.exception("Error processing webhook: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing webhook: {str(e)}"
@@ -292,97 +564,36 @@ async def deployment_webhook(data: dict):
 
 # WebSocket connection for real-time deployment updates
 @app.websocket("/ws/deployments/{deployment_id}")
-async def websocket_deployment(websocket: WebSocket, deployment_id: str):
-    await websocket.accept()
+async def websocket_deployment(websocket: WebSocket, deployment_id: str, token: Optional[str] = None):
+    bind_deployment(deployment_id)
     
-    try:
-        # Send initial deployment status
-        from src.supabase import get_deployment
-        deployment = get_deployment(deployment_id)
-        
-        if not deployment:
-            await websocket.send_json({"error": "Deployment not found"})
-            await websocket.close()
-            return
-            
-        await websocket.send_json({
-            "type": "status_update",
-            "data": {
-                "deployment_id": deployment.get("id"),
-                "status": deployment.get("status"),
-                "outputs": deployment.get("outputs", {})
-            }
-        })
-        
-        # Keep connection open and periodically check for updates
-        while True:
-            # Re-fetch deployment every 3 seconds
-            await asyncio.sleep(3)
-            current_deployment = get_deployment(deployment_id)
-            
-            if not current_deployment:
-                await websocket.send_json({"error": "Deployment no longer exists"})
-                break
-                
-            # Send update only if status changed
-            if current_deployment.get("status") != deployment.get("status"):
-                await websocket.send_json({
-                    "type": "status_update",
-                    "data": {
-                        "deployment_id": current_deployment.get("id"),
-                        "status": current_deployment.get("status"),
-                        "outputs": current_deployment.get("outputs", {})
-                    }
-                })
-                
-                # If deployment completed or failed, send final message and close
-                if current_deployment.get("status") in ["completed", "failed"]:
-                    await websocket.send_json({
-                        "type": "deployment_finished",
-                        "data": {
-                            "status": current_deployment.get("status"),
-                            "completed_at": current_deployment.get("completed_at")
-                        }
-                    })
-                    break
-                    
-            deployment = current_deployment
-            
-    except WebSocketDisconnect:
-        # Client disconnected
-        pass
-    except Exception as e:
-        # Try to send error message before closing
-        try:
-            await websocket.send_json({"error": str(e)})
-        except:
-            pass
-    finally:
-        # Ensure connection is closed
+    # Connection limits apply per user when a token is given, otherwise per client address
+    key = f"ip:{websocket.client.host if websocket.client else 'unknown'}"
+    if token:
         try:
-            await websocket.close()
-        except:
+            key = f"user:{verify_token(token).username}"
+        except HTTPException:
             pass
+    
+    await connections.serve(websocket, deployment_id, key)
 
-# Background task to check for stalled deployments
-async def check_stalled_deployments():
-    while True:
-        try:
-            from src.supabase import update_stalled_deployments
-            
-            # Check every minute
-            await asyncio.sleep(60)
-            result = update_stalled_deployments()
-            if result and len(result) > 0:
-                print(f"Updated {len(result)} stalled deployments")
-        except Exception as e:
-            print(f"Error checking stalled deployments: {str(e)}")
+# Background job marking deployments stuck in pending as failed
+@scheduler.job("stalled_deployments", interval=60)
+def check_stalled_deployments():
+    result = update_stalled_deployments()
+    if result.get("updated_count"):
+        logger.info("Updated %s stalled deployments", result["updated_count"])
+    return result
+
+# Background jobs re-fetching deployments this worker served stale during an outage
+# and saving the ones it dispatched but could not record
+scheduler.register("refresh_stale_deployments", refresh_stale_deployments, interval=15, leased=False)
+scheduler.register("save_pending_deployments", save_pending_deployments, interval=15, leased=False)
 
-# Startup event to initialize background tasks
-@app.on_event("startup")
-async def startup_event():
-    # Start background task for checking stalled deployments
-    asyncio.create_task(check_stalled_deployments())
+# Background job moving old finished deployments to the cold archive, only once
+# both a retention period and a place to keep the archive are configured
+if get_settings().archive_retention_days > 0 and get_settings().archive_url:
+    scheduler.register("archive_deployments", archive_finished_deployments, interval=get_settings().archive_interval_seconds)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
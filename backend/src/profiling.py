@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from src.auth import get_user_from_token
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Frames from files matching these markers are attributed to a dependency in the profile breakdown
+_BREAKDOWN_MARKERS = {
+    "supabase": ("supabase", "postgrest"),
+    "github": ("github_api.py", "httpx", "httpcore"),
+    "serialization": ("json", "encoders.py", "pydantic")
+}
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread
+
+    Stacks are stored in collapsed form ("outer;inner;leaf" -> count), the
+    input format of flamegraph.pl, speedscope and similar tools. Profiling
+    the event loop thread captures everything the loop runs in that time,
+    including other requests, and shows awaited network I/O as the loop
+    waiting in its selector.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started_at = datetime.utcnow()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+def breakdown(stacks: Counter) -> Dict[str, int]:
+    """Count samples whose stack passes through Supabase, GitHub or serialization code"""
+    totals = {name: 0 for name in _BREAKDOWN_MARKERS}
+    for stack, count in stacks.items():
+        for name, markers in _BREAKDOWN_MARKERS.items():
+            if any(marker in stack for marker in markers):
+                totals[name] += count
+    return totals
+
+class RequestProfiler:
+    """Holds the sampling settings and a rolling buffer of recent request profiles"""
+
+    def __init__(self, sample_rate: float = 0.0, buffer_size: int = 50, interval: float = 0.001):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.profiles: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self) -> StackSampler:
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        return sampler
+
+    def finish(
+        self,
+        profile_id: str,
+        sampler: StackSampler,
+        method: str,
+        path: str,
+        duration: float,
+        reason: str
+    ) -> Dict[str, Any]:
+        stacks = sampler.stop()
+        profile = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "reason": reason,
+            "started_at": sampler.started_at.isoformat(),
+            "duration_ms": round(duration * 1000, 2),
+            "interval_ms": self.interval * 1000,
+            "samples": sampler.samples,
+            "breakdown": breakdown(stacks),
+            "stacks": stacks
+        }
+        self.profiles.append(profile)
+        return profile
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """Summaries of buffered profiles, newest first"""
+        return [
+            {key: value for key, value in profile.items() if key != "stacks"}
+            for profile in reversed(self.profiles)
+        ]
+
+    def get_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        for profile in self.profiles:
+            if profile["id"] == profile_id:
+                return profile
+        return None
+
+def collapsed(profile: Dict[str, Any]) -> str:
+    """Render a profile as collapsed stacks for flamegraph tools"""
+    return "\n".join(f"{stack} {count}" for stack, count in profile["stacks"].most_common()) + "\n"
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles single requests on demand
+
+    An admin can profile a request by sending `X-Profile: 1` or `?profile=1`;
+    the profile id is returned in the `X-Profile-Id` response header. With a
+    non-zero sample rate a fraction of all requests is also profiled into the
+    rolling buffer. When neither applies the request passes straight through.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        reason = None
+        if self._requested(scope):
+            if await self._is_admin(scope):
+                reason = "on_demand"
+        elif self.profiler.should_sample():
+            reason = "sampled"
+
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        sampler = self.profiler.start()
+        started = time.perf_counter()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start" and reason == "on_demand":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.profiler.finish(
+                profile_id, sampler, scope.get("method", ""), scope.get("path", ""),
+                time.perf_counter() - started, reason
+            )
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        if query.get("profile") in ("1", "true"):
+            return True
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile":
+                return value in (b"1", b"true")
+        return False
+
+    @staticmethod
+    async def _is_admin(scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    # The user lookup hits Supabase; keep it off the loop, and since this
+                    # runs outside the app's exception handlers, skip profiling if it fails
+                    try:
+                        user = await asyncio.to_thread(get_user_from_token, token)
+                    except Exception as e:
+                        logger.warning("Not profiling request, admin check failed: %s", e)
+                        return False
+                    return user is not None and user.role == "admin"
+        return False
+
+def create_profiler() -> RequestProfiler:
+    settings = get_settings()
+    return RequestProfiler(
+        sample_rate=settings.profile_sample_rate,
+        buffer_size=settings.profile_buffer_size,
+        interval=settings.profile_interval_ms / 1000
+    )
+
+profiler = create_profiler()
@@ -0,0 +1,260 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException
+
+from src.auth import verify_token
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Request body fields kept verbatim: small enums that shape the work done
+SHAPE_FIELDS = ["status", "resource_type", "environment", "region", "include_logs"]
+
+# Query parameters kept verbatim; other values are masked
+QUERY_FIELDS = ["format", "status", "resource_type", "environment", "include_logs"]
+
+# Numeric paging parameters kept as numbers; numbers elsewhere (ids, search terms) are masked
+PAGING_FIELDS = ["after", "limit", "offset", "page_size"]
+
+# Largest request or response body parsed for its shape
+_MAX_PARSED_BYTES = 256 * 1024
+
+# Route recorded for requests that matched no route, so probes do not leak their paths
+UNMATCHED_ROUTE = "/{unmatched}"
+
+class TrafficRecorder:
+    """
+    Writes anonymized request shapes to JSON lines traces (gzip if the path ends in .gz)
+
+    Every worker process writes its own trace, named after the path with the
+    process id added (trace.jsonl.gz becomes trace-1234.jsonl.gz). The first
+    line is a header; every other line is one request or WebSocket session.
+    Deployment ids and usernames are replaced by aliases keyed with the JWT
+    secret ("d" or "u" and a short digest), so they match across workers and
+    polling, webhook sequences and watchers of the same deployment stay
+    related without the trace holding real identifiers.
+    Only sizes, routes, timings and the SHAPE_FIELDS, QUERY_FIELDS and
+    PAGING_FIELDS values are kept.
+    Lines are written by a background thread.
+    """
+
+    def __init__(self, path: str, key: Optional[str] = None):
+        self.path = path
+        self.started = time.monotonic()
+        self.recorded = 0
+        self._key = (key or "").encode()[:64]
+        self._aliases: Dict[tuple, str] = {}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def alias(self, kind: str, value: Any) -> Optional[str]:
+        """Stable alias for a deployment id ("d") or username ("u")"""
+        if value is None or value == "":
+            return None
+        alias = self._aliases.get((kind, value))
+        if alias is None:
+            digest = hashlib.blake2b(str(value).encode(), key=self._key, digest_size=5).hexdigest()
+            alias = self._aliases[(kind, value)] = f"{kind}{digest}"
+        return alias
+
+    def worker_path(self) -> str:
+        """The trace written by this process"""
+        directory, name = os.path.split(self.path)
+        stem, dot, extension = name.partition(".")
+        return os.path.join(directory, f"{stem}-{os.getpid()}{dot}{extension}")
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def record(self, event: Dict[str, Any]):
+        """Queue an event for the writer thread"""
+        if self._thread is None:
+            self._start()
+        self.recorded += 1
+        self._queue.put(event)
+
+    def close(self):
+        """Flush queued events and close the trace"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+            logger.info("Recorded %s requests to %s", self.recorded, self.worker_path())
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write, name="traffic-recorder", daemon=True)
+                self._thread.start()
+
+    def _write(self):
+        # Started on the first request, so the path carries the worker's pid even when the app was imported before forking
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.worker_path(), "wt") as f:
+            f.write(json.dumps({"v": 1, "started_at": datetime.utcnow().isoformat()}) + "\n")
+            while True:
+                event = self._queue.get()
+                if event is None:
+                    return
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+def route_template(scope) -> str:
+    """The request path with path parameters put back as {name}, or UNMATCHED_ROUTE"""
+    if "endpoint" not in scope:
+        return UNMATCHED_ROUTE
+    path_params = scope.get("path_params") or {}
+    if not path_params:
+        return scope.get("path", "")
+    by_value = {str(value): f"{{{name}}}" for name, value in path_params.items()}
+    return "/".join(by_value.get(segment, segment) for segment in scope.get("path", "").split("/"))
+
+def body_shape(recorder: TrafficRecorder, body: Any) -> Dict[str, Any]:
+    """The parts of a JSON request body that affect how it is processed"""
+    if not isinstance(body, dict):
+        return {}
+    shape: Dict[str, Any] = {field: body[field] for field in SHAPE_FIELDS if isinstance(body.get(field), (str, bool))}
+    if body.get("deployment_id"):
+        shape["deployment"] = recorder.alias("d", body["deployment_id"])
+    if isinstance(body.get("ids"), list):
+        shape["ids"] = [recorder.alias("d", value) for value in body["ids"]]
+    if isinstance(body.get("logs"), list):
+        shape["logs"] = len(body["logs"])
+    if isinstance(body.get("parameters"), dict):
+        shape["parameters"] = len(body["parameters"])
+    return shape
+
+def query_shape(query_string: bytes) -> Dict[str, Any]:
+    """Query parameters with PAGING_FIELDS numbers and QUERY_FIELDS kept and other values masked to their length"""
+    shape: Dict[str, Any] = {}
+    for name, value in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True):
+        if name == "token":
+            continue
+        if name in PAGING_FIELDS and value.isdigit():
+            shape[name] = int(value)
+        else:
+            shape[name] = value if name in QUERY_FIELDS else "x" * len(value)
+    return shape
+
+class RecordingMiddleware:
+    """ASGI middleware feeding every HTTP request and WebSocket session to a TrafficRecorder"""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        event: Dict[str, Any] = {
+            "t": round(self.recorder.elapsed(), 4),
+            "k": scope["type"][0],
+            "m": scope.get("method", "WS")
+        }
+        user = self.recorder.alias("u", self._username(scope))
+        if user:
+            event["u"] = user
+        request_body: List[bytes] = []
+        response_body: List[bytes] = []
+        sizes = {"in": 0, "out": 0}
+
+        async def recording_receive():
+            message = await receive()
+            chunk = message.get("body") or message.get("bytes") or (message.get("text") or "").encode()
+            sizes["in"] += len(chunk)
+            if scope["type"] == "http" and sizes["in"] <= _MAX_PARSED_BYTES:
+                request_body.append(chunk)
+            return message
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                event["s"] = message["status"]
+            elif message["type"] == "websocket.close":
+                event["s"] = message.get("code", 1000)
+            chunk = message.get("body") or message.get("bytes") or (message.get("text") or "").encode()
+            sizes["out"] += len(chunk)
+            if scope.get("method") == "POST" and sizes["out"] <= _MAX_PARSED_BYTES:
+                response_body.append(chunk)
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            event["r"] = route_template(scope)
+            event["ms"] = round((time.perf_counter() - started) * 1000, 2)
+            event["in"] = sizes["in"]
+            event["out"] = sizes["out"]
+            self._describe(event, scope, request_body, response_body)
+            self.recorder.record(event)
+
+    def _describe(self, event: Dict[str, Any], scope, request_body: List[bytes], response_body: List[bytes]):
+        path_params = scope.get("path_params") or {}
+        if path_params.get("deployment_id"):
+            event["d"] = self.recorder.alias("d", path_params["deployment_id"])
+
+        query = query_shape(scope.get("query_string", b""))
+        if query:
+            event["q"] = query
+
+        body = self._parse(request_body)
+        shape = body_shape(self.recorder, body)
+        if shape:
+            event["b"] = shape
+        elif request_body and "u" not in event:
+            # Form logins: keep who logged in, never the password
+            username = dict(parse_qsl(b"".join(request_body).decode("latin-1"))).get("username")
+            if username:
+                event["u"] = self.recorder.alias("u", username)
+
+        # Ids assigned by the API, so later requests for them can be related
+        response = self._parse(response_body)
+        if isinstance(response, dict):
+            created = response.get("request_id") or response.get("deployment_id")
+            if created:
+                event["c"] = self.recorder.alias("d", created)
+
+    @staticmethod
+    def _parse(chunks: List[bytes]) -> Any:
+        if not chunks:
+            return None
+        try:
+            return json.loads(b"".join(chunks))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _username(scope) -> Optional[str]:
+        token = None
+        for name, value in scope.get("headers", []):
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                break
+        if token is None:
+            token = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"))).get("token")
+        if not token:
+            return None
+        try:
+            return verify_token(token).username
+        except HTTPException:
+            return None
+
+def create_recorder() -> Optional[TrafficRecorder]:
+    """The recorder configured by RECORD_TRAFFIC_PATH, or None when recording is off"""
+    settings = get_settings()
+    path = settings.record_traffic_path
+    return TrafficRecorder(path, settings.jwt_secret_key) if path else None
+
+recorder = create_recorder()
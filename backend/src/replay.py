@@ -0,0 +1,487 @@
+"""
+Replay a recorded traffic trace against the API with local stand-ins for Supabase and GitHub
+
+    python -m src.replay trace-*.jsonl.gz --speed 10
+
+Record a trace by setting RECORD_TRAFFIC_PATH on a running instance; each
+worker writes its own file, and the files given are merged by their start
+times. The replay runs the app in-process, schedules every recorded request at its
+original offset divided by --speed without waiting for earlier ones, and
+reports latency percentiles per route together with database and GitHub
+call counts.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+REPLAY_SECRET = "replay"
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+class _Query:
+    """The subset of the PostgREST query builder used by src.supabase"""
+
+    def __init__(self, store: "LocalSupabase", table: str, op: str, payload: Any = None):
+        self.store = store
+        self.table = table
+        self.op = op
+        self.payload = payload
+        self.columns = "*"
+        self.filters: List = []
+        self.order_by: Optional[tuple] = None
+        self.row_limit: Optional[int] = None
+
+    def select(self, columns: str = "*"):
+        self.columns = columns
+        return self
+
+    def eq(self, field, value):
+        self.filters.append(lambda row: row.get(field) == value)
+        return self
+
+    def in_(self, field, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(field) in values)
+        return self
+
+    def is_(self, field, value):
+        self.filters.append(lambda row: row.get(field) is None if value == "null" else row.get(field) == value)
+        return self
+
+    def lt(self, field, value):
+        self.filters.append(lambda row: row.get(field) is not None and row.get(field) < value)
+        return self
+
+    def gt(self, field, value):
+        self.filters.append(lambda row: row.get(field) is not None and row.get(field) > value)
+        return self
+
+    def order(self, field, desc: bool = False):
+        self.order_by = (field, desc)
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    def execute(self) -> _Response:
+        return self.store.execute(self)
+
+class _Table:
+    def __init__(self, store: "LocalSupabase", name: str):
+        self.store = store
+        self.name = name
+
+    def select(self, columns: str = "*"):
+        return _Query(self.store, self.name, "select").select(columns)
+
+    def insert(self, data):
+        return _Query(self.store, self.name, "insert", data)
+
+    def update(self, data):
+        return _Query(self.store, self.name, "update", data)
+
+    def delete(self):
+        return _Query(self.store, self.name, "delete")
+
+class LocalSupabase:
+    """In-memory stand-in for the Supabase client that counts calls and adds a fixed latency"""
+
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+        self.tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> _Table:
+        return _Table(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> _Query:
+        return _Query(self, name, "rpc", params)
+
+    def execute(self, query: _Query) -> _Response:
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls[f"{query.table}.{query.op}"] += 1
+            if query.op == "rpc":
+                return _Response(True)
+
+            rows = self.tables[query.table]
+            if query.op == "insert":
+                new_rows = query.payload if isinstance(query.payload, list) else [query.payload]
+                rows.extend(dict(row) for row in new_rows)
+                return _Response([dict(row) for row in new_rows])
+
+            matched = [row for row in rows if all(match(row) for match in query.filters)]
+            if query.op == "update":
+                for row in matched:
+                    row.update(query.payload)
+            elif query.op == "delete":
+                self.tables[query.table] = [row for row in rows if row not in matched]
+                return _Response(matched)
+
+            if query.order_by:
+                field, desc = query.order_by
+                matched.sort(key=lambda row: row.get(field) or "", reverse=desc)
+            if query.row_limit is not None:
+                matched = matched[:query.row_limit]
+            if query.columns != "*":
+                columns = query.columns.split(",")
+                return _Response([{column: row.get(column) for column in columns} for row in matched])
+            return _Response([dict(row) for row in matched])
+
+class LocalGitHub:
+    """Answers workflow dispatches with 204 after a fixed latency"""
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+        self.dispatches = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        self.dispatches += 1
+        return httpx.Response(204)
+
+def load_trace(paths: List[str]) -> List[Dict[str, Any]]:
+    """Events of one or more worker traces, ordered by start offset from the earliest trace"""
+    traces = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        header = next((line for line in lines if "started_at" in line), {})
+        started = datetime.fromisoformat(header["started_at"]) if "started_at" in header else None
+        traces.append((started, [line for line in lines if "t" in line]))
+
+    starts = [started for started, _ in traces if started is not None]
+    first = min(starts) if starts else None
+    events = []
+    for started, trace_events in traces:
+        shift = (started - first).total_seconds() if started is not None and first is not None else 0.0
+        for event in trace_events:
+            event["t"] = round(event["t"] + shift, 4)
+            events.append(event)
+    return sorted(events, key=lambda event: event["t"])
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+def _referenced(event: Dict[str, Any]) -> List[str]:
+    body = event.get("b") or {}
+    aliases = [event.get("d"), body.get("deployment")] + list(body.get("ids") or [])
+    return [alias for alias in aliases if alias]
+
+class Replayer:
+    """Seeds the stand-ins from a trace and plays its events against the app"""
+
+    def __init__(self, app, events: List[Dict[str, Any]], speed: float, db: LocalSupabase, github: LocalGitHub):
+        self.app = app
+        self.events = events
+        self.speed = speed
+        self.db = db
+        self.github = github
+
+        self.ids: Dict[str, str] = {}
+        self.created: Dict[str, asyncio.Event] = {}
+        self.tokens: Dict[str, str] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.max_lag = 0.0
+
+    def seed(self):
+        """Users for every user alias; rows for deployments that existed before the recording"""
+        from src.auth import create_access_token
+        from passlib.context import CryptContext
+
+        password = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(REPLAY_SECRET)
+        for alias in {event["u"] for event in self.events if event.get("u")}:
+            # Roles are not recorded; admin passes every permission check
+            self.db.tables["users"].append({"username": alias, "email": None, "role": "admin", "password": password})
+            self.tokens[alias] = create_access_token({"sub": alias})
+
+        webhooks = {}
+        for event in self.events:
+            if event.get("c"):
+                self.created[event["c"]] = asyncio.Event()
+            body = event.get("b") or {}
+            if event["r"] == "/api/webhook/deployment" and body.get("deployment"):
+                webhooks.setdefault(body["deployment"], body)
+
+        now = datetime.utcnow().isoformat()
+        for event in self.events:
+            for alias in _referenced(event):
+                if alias in self.created or alias in self.ids:
+                    continue
+                shape = webhooks.get(alias, {})
+                self.ids[alias] = f"replay-{alias}"
+                self.db.tables["deployments"].append({
+                    "id": self.ids[alias],
+                    "name": alias,
+                    "resource_type": shape.get("resource_type", "s3_bucket"),
+                    "environment": shape.get("environment", "dev"),
+                    "region": shape.get("region", "eu-west-2"),
+                    "status": "pending" if alias in webhooks else "completed",
+                    "parameters": {},
+                    "outputs": {},
+                    "logs": [],
+                    "created_at": now
+                })
+
+    def _id(self, alias: Optional[str]) -> str:
+        return self.ids.get(alias, f"replay-{alias}")
+
+    async def _wait_for_deployments(self, event: Dict[str, Any]):
+        # A deployment created during the replay is only known once its create call returns,
+        # as in production where webhooks and polling follow the dispatch
+        for alias in _referenced(event):
+            if alias in self.created and event.get("c") != alias:
+                try:
+                    await asyncio.wait_for(self.created[alias].wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _path(self, event: Dict[str, Any]) -> str:
+        segments = []
+        for segment in event["r"].split("/"):
+            if segment == "{deployment_id}":
+                segment = self._id(event.get("d"))
+            elif segment.startswith("{"):
+                segment = "x"
+            segments.append(segment)
+        return "/".join(segments)
+
+    def _body(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        shape = event.get("b") or {}
+        body: Dict[str, Any] = {field: value for field, value in shape.items() if field not in ("deployment", "ids", "logs", "parameters")}
+
+        if event["r"] == "/api/webhook/deployment":
+            body.update({
+                "secret": REPLAY_SECRET,
+                "deployment_id": self._id(shape.get("deployment")),
+                "name": shape.get("deployment") or "replay"
+            })
+            for field, default in (("resource_type", "s3_bucket"), ("environment", "dev"), ("region", "eu-west-2"), ("status", "pending")):
+                body.setdefault(field, default)
+        else:
+            body.setdefault("name", f"replay-{event['t']}")
+            body.setdefault("resource_type", "s3_bucket")
+            body.setdefault("environment", "dev")
+            body.update({"size": "small", "region": body.get("region", "eu-west-2"), "sample_rate": 0.0})
+
+        if "ids" in shape:
+            body["ids"] = [self._id(alias) for alias in shape["ids"]]
+        if "logs" in shape:
+            body["logs"] = [f"replayed log line {index}" for index in range(shape["logs"])]
+        body["parameters"] = {f"param_{index}": "x" for index in range(shape.get("parameters", 0))}
+
+        # Pad to the recorded size so parsing and storage costs match
+        missing = event.get("in", 0) - len(json.dumps({**body, "padding": ""}))
+        if missing > 0:
+            body["padding"] = "x" * missing
+        return body
+
+    async def run(self) -> float:
+        """Play every event on its schedule and wait for all of them; returns the wall time"""
+        transport = httpx.ASGITransport(app=self.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=60) as client:
+            started = time.perf_counter()
+            tasks = []
+            for event in self.events:
+                delay = started + event["t"] / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+                if event["k"] == "w":
+                    tasks.append(asyncio.create_task(self._websocket(event)))
+                else:
+                    tasks.append(asyncio.create_task(self._http(client, event)))
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+    async def _http(self, client: httpx.AsyncClient, event: Dict[str, Any]):
+        key = f"{event['m']} {event['r']}"
+        headers = {"Authorization": f"Bearer {self.tokens[event['u']]}"} if event.get("u") in self.tokens else {}
+        await self._wait_for_deployments(event)
+        kwargs: Dict[str, Any] = {"params": event.get("q") or {}, "headers": headers}
+        if event["r"] == "/api/token":
+            kwargs["data"] = {"username": event.get("u") or "replay", "password": REPLAY_SECRET}
+        elif event["m"] in ("POST", "PUT", "PATCH"):
+            kwargs["json"] = self._body(event)
+
+        started = time.perf_counter()
+        try:
+            response = await client.request(event["m"], self._path(event), **kwargs)
+        except Exception as e:
+            self.statuses[key][type(e).__name__] += 1
+            if event.get("c"):
+                self.created[event["c"]].set()
+            return
+        self.latencies[key].append((time.perf_counter() - started) * 1000)
+        self.statuses[key][response.status_code] += 1
+
+        if event.get("c"):
+            if response.status_code < 300:
+                created = response.json()
+                self.ids[event["c"]] = created.get("request_id") or created.get("deployment_id")
+            self.created[event["c"]].set()
+
+    async def _websocket(self, event: Dict[str, Any]):
+        """Hold a WebSocket session for the recorded duration, answering pings"""
+        key = f"WS {event['r']}"
+        await self._wait_for_deployments(event)
+        token = self.tokens.get(event.get("u"))
+        incoming: asyncio.Queue = asyncio.Queue()
+        first_message = asyncio.Event()
+        closed = asyncio.Event()
+        scope = {
+            "type": "websocket",
+            "path": self._path(event),
+            "raw_path": self._path(event).encode(),
+            "query_string": f"token={token}".encode() if token else b"",
+            "headers": [],
+            "scheme": "ws",
+            "server": ("replay", 80),
+            "client": ("127.0.0.1", 0),
+            "subprotocols": [],
+            "asgi": {"version": "3.0"}
+        }
+
+        async def receive():
+            return await incoming.get()
+
+        async def send(message):
+            if message["type"] == "websocket.send":
+                first_message.set()
+                if '"ping"' in (message.get("text") or ""):
+                    incoming.put_nowait({"type": "websocket.receive", "text": '{"type":"pong"}'})
+            elif message["type"] == "websocket.close":
+                closed.set()
+                incoming.put_nowait({"type": "websocket.disconnect", "code": message.get("code", 1000)})
+
+        incoming.put_nowait({"type": "websocket.connect"})
+        started = time.perf_counter()
+        session = asyncio.create_task(self.app(scope, receive, send))
+        try:
+            await asyncio.wait_for(first_message.wait(), timeout=30)
+            self.latencies[key].append((time.perf_counter() - started) * 1000)
+            self.statuses[key]["open"] += 1
+            try:
+                await asyncio.wait_for(closed.wait(), timeout=event.get("ms", 0) / 1000 / self.speed)
+            except asyncio.TimeoutError:
+                incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+            await session
+        except Exception as e:
+            self.statuses[key][type(e).__name__] += 1
+            session.cancel()
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        requests = sum(sum(counter.values()) for counter in self.statuses.values())
+        routes = {}
+        for key in sorted(self.statuses):
+            values = self.latencies.get(key) or [0.0]
+            routes[key] = {
+                "count": sum(self.statuses[key].values()),
+                "p50_ms": round(percentile(values, 0.5), 2),
+                "p90_ms": round(percentile(values, 0.9), 2),
+                "p99_ms": round(percentile(values, 0.99), 2),
+                "max_ms": round(max(values), 2),
+                "statuses": {str(status): count for status, count in self.statuses[key].items()}
+            }
+        db_calls = sum(self.db.calls.values())
+        return {
+            "events": len(self.events),
+            "speed": self.speed,
+            "wall_seconds": round(wall_seconds, 2),
+            "max_schedule_lag_ms": round(self.max_lag * 1000, 2),
+            "routes": routes,
+            "db_calls": db_calls,
+            "db_calls_per_request": round(db_calls / requests, 2) if requests else 0,
+            "db_calls_by_table": dict(self.db.calls.most_common()),
+            "github_dispatches": self.github.dispatches
+        }
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"Replayed {report['events']} events in {report['wall_seconds']}s at {report['speed']}x "
+        f"(max schedule lag {report['max_schedule_lag_ms']} ms)",
+        "",
+        f"{'route':<52} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses"
+    ]
+    for route, stats in report["routes"].items():
+        statuses = " ".join(f"{status}:{count}" for status, count in sorted(stats["statuses"].items()))
+        lines.append(
+            f"{route:<52} {stats['count']:>6} {stats['p50_ms']:>8} {stats['p90_ms']:>8} "
+            f"{stats['p99_ms']:>8} {stats['max_ms']:>8}  {statuses}"
+        )
+    lines.append("")
+    lines.append(f"Database calls: {report['db_calls']} ({report['db_calls_per_request']} per request)")
+    for name, count in report["db_calls_by_table"].items():
+        lines.append(f"  {name:<30} {count:>8}")
+    lines.append(f"GitHub dispatches: {report['github_dispatches']}")
+    return "\n".join(lines)
+
+async def replay(paths: List[str], speed: float, db_latency: float, github_latency: float) -> Dict[str, Any]:
+    """Run the app with local stand-ins, replay the trace and return the report"""
+    # Settings are read once, so the replay environment is set before the app is imported
+    os.environ.pop("RECORD_TRAFFIC_PATH", None)
+    os.environ.update({
+        "WEBHOOK_SECRET": REPLAY_SECRET,
+        "GITHUB_TOKEN": REPLAY_SECRET,
+        "BROADCAST_URL": "memory://",
+        "SCHEDULER_LEASE_URL": "memory://",
+        "ARCHIVE_RETENTION_DAYS": "0"
+    })
+    os.environ.setdefault("JWT_SECRET_KEY", REPLAY_SECRET)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from src import github_api, supabase
+    from src.main import app, lifespan
+
+    db = LocalSupabase(db_latency)
+    github = LocalGitHub(github_latency)
+    supabase._client = db
+    github_api.GITHUB_TOKEN = REPLAY_SECRET
+    github_api._http_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(github.handle)
+    )
+
+    replayer = Replayer(app, load_trace(paths), speed, db, github)
+    replayer.seed()
+    async with lifespan(app):
+        wall_seconds = await replayer.run()
+    return replayer.report(wall_seconds)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay a recorded traffic trace against the API")
+    parser.add_argument("traces", nargs="+", help="worker traces written by RECORD_TRAFFIC_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 1 to 50 (default 1)")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="latency of each stand-in database call")
+    parser.add_argument("--github-latency-ms", type=float, default=300.0, help="latency of each stand-in workflow dispatch")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if not 1 <= args.speed <= 50:
+        parser.error("--speed must be between 1 and 50")
+
+    report = asyncio.run(replay(args.traces, args.speed, args.db_latency_ms / 1000, args.github_latency_ms / 1000))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+if __name__ == "__main__":
+    main()
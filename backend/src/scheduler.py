@@ -0,0 +1,256 @@
+import asyncio
+import fcntl
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from src.config import get_settings
+from src import supabase
+
+logger = logging.getLogger(__name__)
+
+class InProcessLease:
+    """Lease for a single worker: this process is always the leader"""
+
+    def acquire(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        return True
+
+    def release(self, name: str, holder: str):
+        pass
+
+class FileLease:
+    """
+    Lease shared by the workers on one host, using an flock per job
+
+    The lock is held until release() or until the process exits, so a
+    crashed leader hands over as soon as the next tick of another worker.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._fds: Dict[str, int] = {}
+
+    def acquire(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        if name in self._fds:
+            return True
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self._fds[name] = fd
+        return True
+
+    def release(self, name: str, holder: str):
+        fd = self._fds.pop(name, None)
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+class SupabaseLease:
+    """Lease shared by every replica, stored in the job_leases table (see docs/schema.sql)"""
+
+    def acquire(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        return supabase.acquire_job_lease(name, holder, ttl_seconds)
+
+    def release(self, name: str, holder: str):
+        supabase.release_job_lease(name, holder)
+
+def create_lease(url: str):
+    """
+    Build a lease backend from a URL
+
+    memory://             single worker
+    file:///path/to/dir   workers on the same host
+    supabase://           replicas across hosts
+    """
+    parsed = urlparse(url or "memory://")
+
+    if parsed.scheme in ("", "memory"):
+        return InProcessLease()
+    if parsed.scheme == "file":
+        return FileLease(parsed.path or "/tmp/platform-hub-leases")
+    if parsed.scheme == "supabase":
+        return SupabaseLease()
+
+    raise ValueError(f"Unsupported scheduler lease URL scheme: {parsed.scheme}")
+
+class Job:
+    """A periodic job and its run statistics"""
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: float, jitter: float, run_at_start: bool, leased: bool = True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.leased = leased
+
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started_at: Optional[str] = None
+        self.last_duration: Optional[float] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+
+    def next_delay(self) -> float:
+        """Interval with +/- jitter so replicas do not fire in lockstep"""
+        spread = self.interval * self.jitter
+        return max(0.0, self.interval + random.uniform(-spread, spread))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started_at": self.last_started_at,
+            "last_duration": self.last_duration,
+            "last_result": self.last_result,
+            "last_error": self.last_error
+        }
+
+class Scheduler:
+    """
+    Runs registered periodic jobs on the event loop
+
+    Each job runs on only one instance at a time: before every run the
+    scheduler takes (or renews) a lease named after the job, valid for
+    twice the interval, and skips the run if another instance holds it.
+    Jobs registered with leased=False maintain per-process state and run on
+    every instance. Synchronous job functions run in a worker thread.
+    """
+
+    def __init__(self, lease=None):
+        self.holder = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease = lease or InProcessLease()
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+
+    def register(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        interval: float,
+        jitter: float = 0.1,
+        run_at_start: bool = False,
+        leased: bool = True
+    ) -> Job:
+        """Register a job; call before start()"""
+        if name in self._jobs:
+            raise ValueError(f"Job already registered: {name}")
+
+        job = Job(name, func, interval, jitter, run_at_start, leased)
+        self._jobs[name] = job
+        return job
+
+    def job(self, name: str, interval: float, jitter: float = 0.1, run_at_start: bool = False, leased: bool = True):
+        """Decorator form of register()"""
+        def decorator(func):
+            self.register(name, func, interval, jitter, run_at_start, leased)
+            return func
+        return decorator
+
+    async def start(self):
+        """Start one task per registered job"""
+        self._stopping = False
+        for name, job in self._jobs.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(self._run_forever(job), name=f"job:{name}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop job loops, waiting up to timeout for running jobs to finish, and release leases"""
+        self._stopping = True
+        running = []
+        for name, task in self._tasks.items():
+            if self._jobs[name].running:
+                running.append(task)
+            else:
+                task.cancel()
+
+        # Running jobs may still be using the Supabase client, which is closed after this
+        if running:
+            _, unfinished = await asyncio.wait(running, timeout=timeout)
+            for task in unfinished:
+                logger.warning("%s still running after %gs, cancelling it", task.get_name(), timeout)
+                task.cancel()
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks)
+        self._tasks.clear()
+
+        for name, job in self._jobs.items():
+            if not job.leased:
+                continue
+            try:
+                await asyncio.to_thread(self.lease.release, name, self.holder)
+            except Exception as e:
+                logger.warning("Error releasing lease for job %s: %s", name, e)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-job run statistics"""
+        return {name: job.stats() for name, job in self._jobs.items()}
+
+    async def run_now(self, name: str):
+        """Run a job immediately on this instance, subject to overlap prevention"""
+        await self._run_once(self._jobs[name])
+
+    async def _run_forever(self, job: Job):
+        if not job.run_at_start:
+            await asyncio.sleep(job.next_delay())
+
+        while not self._stopping:
+            await self._run_once(job)
+            if self._stopping:
+                return
+            await asyncio.sleep(job.next_delay())
+
+    async def _run_once(self, job: Job):
+        if job.running:
+            job.skipped += 1
+            return
+
+        try:
+            leader = not job.leased or await asyncio.to_thread(self.lease.acquire, job.name, self.holder, int(job.interval * 2))
+        except Exception as e:
+            logger.warning("Error acquiring lease for job %s: %s", job.name, e)
+            leader = False
+        if not leader:
+            job.skipped += 1
+            return
+
+        job.running = True
+        job.last_started_at = datetime.utcnow().isoformat()
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                job.last_result = await job.func()
+            else:
+                job.last_result = await asyncio.to_thread(job.func)
+            job.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error("Error running job %s: %s", job.name, e)
+        finally:
+            job.runs += 1
+            job.last_duration = time.perf_counter() - started
+            job.running = False
+
+scheduler = Scheduler(create_lease(get_settings().scheduler_lease_url))
@@ -0,0 +1,353 @@
+import asyncio
+import heapq
+import json
+import logging
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from src.archive import hydrate
+from src.broadcast import broadcast, DEPLOYMENTS_CHANNEL
+from src import supabase
+
+logger = logging.getLogger(__name__)
+
+# Top-level columns indexed as scoped fields
+INDEXED_FIELDS = ["name", "resource_type", "status", "environment", "region"]
+
+# Columns needed to index a deployment (logs are never indexed)
+INDEX_COLUMNS = "id,name,resource_type,status,environment,region,created_at,parameters,outputs,archived_segment"
+
+# Fields returned with each search hit
+SUMMARY_FIELDS = ["id", "name", "resource_type", "status", "environment", "region", "created_at"]
+
+_SPLIT = re.compile(r"[^a-z0-9]+")
+
+# Sorts after every term sharing a prefix
+_PREFIX_END = "\U0010ffff"
+
+class QueryTooBroad(ValueError):
+    """A prefix clause matches too many terms and the rest of the query does not narrow it"""
+
+def _as_dict(value) -> Dict[str, Any]:
+    # save_deployment stores nested parameter values as JSON strings
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+            return parsed if isinstance(parsed, dict) else {}
+        except ValueError:
+            return {}
+    return {}
+
+def tokenize(value: Any) -> Set[str]:
+    """The full lowercased value plus its alphanumeric parts"""
+    text = str(value).strip().lower()
+    if not text:
+        return set()
+    tokens = {text}
+    tokens.update(part for part in _SPLIT.split(text) if part)
+    return tokens
+
+def extract_terms(deployment: Dict[str, Any]) -> Set[str]:
+    """
+    Index terms for a deployment
+
+    Each value produces a scoped term "field:token" and an unscoped term
+    ":token"; parameter and output keys also produce "key:<name>".
+    """
+    fields: List[tuple] = [(field, deployment.get(field)) for field in INDEXED_FIELDS]
+    for source in ("parameters", "outputs"):
+        for key, value in _as_dict(deployment.get(source)).items():
+            fields.append(("key", key))
+            fields.append((str(key).lower(), value))
+
+    terms = set()
+    for field, value in fields:
+        if value is None or value == "":
+            continue
+        for token in tokenize(value):
+            terms.add(f"{field}:{token}")
+            terms.add(f":{token}")
+    return terms
+
+class SearchIndex:
+    """
+    In-memory inverted index over deployments
+
+    Postings map terms to deployment ids; a sorted term list serves prefix
+    queries by binary search and a list ordered by created_at pages through
+    large result sets newest first without sorting them. All mutation
+    happens under a lock because the initial build runs in a worker thread
+    while live updates arrive on the event loop.
+
+    Exact clauses are intersected first, smallest posting set first. Prefix
+    clauses follow, narrowest first: against few candidates each candidate's
+    own terms are checked, otherwise the postings of the matching terms are
+    intersected with the candidates or unioned. Prefixes expanding beyond
+    MAX_PREFIX_TERMS terms are refused unless the candidates are very few.
+    """
+
+    # Above this many matches, pages come from a recency scan instead of a heap
+    SCAN_THRESHOLD = 2000
+
+    # Most terms a prefix clause may expand to
+    MAX_PREFIX_TERMS = 5000
+
+    # Cost of checking one candidate's own terms, in posting entries unioned
+    FILTER_COST = 64
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._sorted_terms: List[str] = []
+        self._recency: List[tuple] = []
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._created: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._dirty: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.built = False
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def add(self, deployment: Dict[str, Any], bulk: bool = False):
+        """
+        Index a deployment, replacing any previous version of it
+
+        With bulk=True the term and recency lists are appended to unsorted;
+        the caller must call _sort_locked() before the index is queried.
+        """
+        deployment_id = deployment["id"]
+        terms = extract_terms(deployment)
+        created_at = deployment.get("created_at") or ""
+
+        with self._lock:
+            self._remove_locked(deployment_id)
+            for term in terms:
+                postings = self._postings[term]
+                if not postings:
+                    if bulk:
+                        self._sorted_terms.append(term)
+                    else:
+                        insort(self._sorted_terms, term)
+                postings.add(deployment_id)
+
+            if bulk:
+                self._recency.append((created_at, deployment_id))
+            else:
+                insort(self._recency, (created_at, deployment_id))
+
+            self._doc_terms[deployment_id] = terms
+            self._created[deployment_id] = created_at
+            self._summaries[deployment_id] = {field: deployment.get(field) for field in SUMMARY_FIELDS}
+
+    def remove(self, deployment_id: str):
+        with self._lock:
+            self._remove_locked(deployment_id)
+
+    def _remove_locked(self, deployment_id: str):
+        for term in self._doc_terms.pop(deployment_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.discard(deployment_id)
+            if not postings:
+                del self._postings[term]
+                self._discard_sorted(self._sorted_terms, term)
+
+        if deployment_id in self._created:
+            self._discard_sorted(self._recency, (self._created.pop(deployment_id), deployment_id))
+        self._summaries.pop(deployment_id, None)
+
+    @staticmethod
+    def _discard_sorted(items: List, item):
+        index = bisect_left(items, item)
+        if index < len(items) and items[index] == item:
+            del items[index]
+
+    def _sort_locked(self):
+        self._sorted_terms.sort()
+        self._recency.sort()
+
+    def _prefix_range(self, prefix: str) -> tuple:
+        # Terms sharing a prefix are contiguous in the sorted term list
+        low = bisect_left(self._sorted_terms, prefix)
+        return low, bisect_left(self._sorted_terms, prefix + _PREFIX_END, low)
+
+    def _match_prefix(self, prefix: str, candidates: Optional[Set[str]]) -> Set[str]:
+        # Returned sets may be live postings and must not be mutated
+        low, high = self._prefix_range(prefix)
+        if high - low > self.MAX_PREFIX_TERMS:
+            # Too many terms to expand, but a few candidates can still be checked one by one
+            if candidates is not None and len(candidates) * self.FILTER_COST <= max(high - low, self.MAX_PREFIX_TERMS):
+                return self._filter_prefix(candidates, prefix)
+            raise QueryTooBroad(f"'{prefix.lstrip(':')}*' matches too many terms; use a longer prefix or add clauses")
+
+        postings = sorted((self._postings[term] for term in self._sorted_terms[low:high]), key=len, reverse=True)
+        if not postings:
+            return set()
+        if len(postings[0]) == len(self._summaries):
+            # A term on every deployment already matches everything the others do
+            return postings[0] if candidates is None else candidates
+        if candidates is None:
+            return postings[0] if len(postings) == 1 else set().union(*postings)
+
+        # Pick the cheapest way to keep the candidates that have a matching term
+        lookups = len(candidates) * len(postings)
+        filtering = len(candidates) * self.FILTER_COST
+        intersecting = sum(min(len(candidates), len(ids)) for ids in postings)
+        if lookups <= min(filtering, intersecting):
+            return {deployment_id for deployment_id in candidates if any(deployment_id in ids for ids in postings)}
+        if filtering < intersecting:
+            return self._filter_prefix(candidates, prefix)
+        return set().union(*(candidates & ids for ids in postings))
+
+    def _filter_prefix(self, candidates: Set[str], prefix: str) -> Set[str]:
+        return {
+            deployment_id for deployment_id in candidates
+            if any(term.startswith(prefix) for term in self._doc_terms[deployment_id])
+        }
+
+    @staticmethod
+    def _term(clause: str) -> tuple:
+        # (term, is prefix)
+        field, sep, value = clause.partition(":")
+        if not sep:
+            field, value = "", clause
+        value = value.strip().lower()
+
+        if value.endswith("*"):
+            return f"{field.lower()}:{value[:-1]}", True
+        return f"{field.lower()}:{value}", False
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """
+        Deployments matching every clause of the query, newest first
+
+        Clauses are separated by spaces: `nginx` matches any field,
+        `container_image:nginx*` is a field-scoped prefix match and
+        `key:bucket_name` matches deployments that have that parameter
+        or output. Raises QueryTooBroad for a prefix matching too many
+        terms.
+        """
+        terms = [self._term(clause) for clause in query.split() if clause]
+        if not terms:
+            return {"total": 0, "results": []}
+
+        with self._lock:
+            exact = sorted((self._postings.get(term, set()) for term, prefix in terms if not prefix), key=len)
+            ranges = {term: self._prefix_range(term) for term, prefix in terms if prefix}
+            prefixes = sorted(ranges, key=lambda term: ranges[term][1] - ranges[term][0])
+
+            matched: Optional[Set[str]] = None
+            for ids in exact:
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    break
+            for prefix in prefixes:
+                if matched is not None and not matched:
+                    break
+                matched = self._match_prefix(prefix, matched)
+
+            if len(matched) > self.SCAN_THRESHOLD:
+                page = []
+                wanted = offset + limit
+                for _, deployment_id in reversed(self._recency):
+                    if deployment_id in matched:
+                        page.append(deployment_id)
+                        if len(page) == wanted:
+                            break
+                page = page[offset:]
+            else:
+                page = heapq.nlargest(offset + limit, matched, key=self._created.__getitem__)[offset:]
+
+            results = [dict(self._summaries[deployment_id]) for deployment_id in page]
+
+        return {"total": len(matched), "results": results}
+
+    def build(self, page_size: int = 1000) -> int:
+        """Index every deployment, paging through the table; runs in a worker thread"""
+        count = 0
+        try:
+            for page in supabase.iter_deployment_pages(page_size, INDEX_COLUMNS):
+                for deployment in page:
+                    self.add(hydrate(deployment), bulk=True)
+                    count += 1
+        finally:
+            # Keep a partial build consistent so a retry can replace its entries
+            with self._lock:
+                self._sort_locked()
+        self.built = True
+        return count
+
+    def mark_dirty(self, message: Dict[str, Any]):
+        """Broadcast handler: queue a changed deployment for re-indexing"""
+        deployment_id = message.get("deployment_id")
+        if deployment_id and message.get("type") in ("created", "invalidate", "status_update"):
+            self._dirty.add(deployment_id)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def start(self):
+        """Build the index in the background and keep it updated from deployment events"""
+        self._wakeup = asyncio.Event()
+        broadcast.subscribe(DEPLOYMENTS_CHANNEL, self.mark_dirty)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        broadcast.unsubscribe(DEPLOYMENTS_CHANNEL, self.mark_dirty)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, max_delay: float = 30.0):
+        # Retry the initial build with backoff until the database answers
+        delay = 1.0
+        while True:
+            try:
+                count = await asyncio.to_thread(self.build)
+                logger.info("Search index built with %s deployments", count)
+                break
+            except Exception as e:
+                logger.warning("Search index build failed, retrying in %.0fs: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Coalesce bursts of webhook updates into one fetch
+            await asyncio.sleep(0.5)
+
+            dirty, self._dirty = self._dirty, set()
+            try:
+                await asyncio.to_thread(self._refresh, dirty)
+            except Exception as e:
+                logger.error("Error refreshing search index: %s", e)
+                self._dirty |= dirty
+                self._wakeup.set()
+                await asyncio.sleep(5)
+
+    def _refresh(self, deployment_ids: Iterable[str]):
+        deployment_ids = list(deployment_ids)
+        found = {
+            deployment["id"]: deployment
+            for deployment in supabase.get_deployments_by_ids(deployment_ids, INDEX_COLUMNS)
+        }
+        for deployment_id in deployment_ids:
+            if deployment_id in found:
+                self.add(hydrate(found[deployment_id]))
+            else:
+                self.remove(deployment_id)
+
+search_index = SearchIndex()
@@ -0,0 +1,565 @@
+import ipaddress
+import logging
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.admission import normalize_environment
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Protocol names and numbers accepted in rules, mapped to the name sent to Terraform
+PROTOCOLS = {
+    "tcp": "tcp", "6": "tcp",
+    "udp": "udp", "17": "udp",
+    "icmp": "icmp", "1": "icmp",
+    "icmpv6": "icmpv6", "58": "icmpv6",
+    "-1": "-1", "all": "-1"
+}
+
+# Protocols whose rules carry a port range
+PORT_PROTOCOLS = ("tcp", "udp")
+
+FULL_RANGE = (0, 65535)
+
+# Rule numbers listed in a finding before the rest are summarized
+LABEL_SOURCES = 3
+
+class InvalidSecurityGroupRules(ValueError):
+    """Ingress rules that cannot be deployed or break the environment's policy"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+class _Entry:
+    """One protocol, port range and CIDR block, the unit AWS counts against its rule limit"""
+
+    __slots__ = ("protocol", "low", "high", "from_port", "to_port", "block", "descriptions", "sources")
+
+    def __init__(self, protocol: str, low: int, high: int, from_port: int, to_port: int, block: tuple, description: str, source: int):
+        self.protocol = protocol
+        # Comparable range: ports for tcp/udp, type * 256 + code for ICMP, everything for -1
+        self.low = low
+        self.high = high
+        self.from_port = from_port
+        self.to_port = to_port
+        # (version, first address, last address, CIDR, prefix length)
+        self.block = block
+        self.descriptions = [description] if description else []
+        self.sources = [source]
+
+    def label(self) -> str:
+        rules = _numbers(self.sources)
+        if self.protocol == "-1":
+            return f"rule {rules} (all traffic from {self.block[3]})"
+        if self.protocol in PORT_PROTOCOLS:
+            ports = str(self.from_port) if self.from_port == self.to_port else f"{self.from_port}-{self.to_port}"
+            return f"rule {rules} ({self.protocol} {ports} from {self.block[3]})"
+        return f"rule {rules} ({self.protocol} {self.from_port}/{self.to_port} from {self.block[3]})"
+
+class PortIntervals:
+    """Sorted, disjoint, closed integer intervals with logarithmic cover and overlap queries"""
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        for low, high in merge_intervals(intervals):
+            self.starts.append(low)
+            self.ends.append(high)
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def items(self) -> List[Tuple[int, int]]:
+        return list(zip(self.starts, self.ends))
+
+    def covers(self, low: int, high: int) -> bool:
+        index = bisect_right(self.starts, low) - 1
+        return index >= 0 and self.ends[index] >= high
+
+    def overlaps(self, low: int, high: int) -> bool:
+        index = bisect_right(self.starts, high) - 1
+        return index >= 0 and self.ends[index] >= low
+
+    def intersection(self, other: "PortIntervals") -> "PortIntervals":
+        result = PortIntervals()
+        mine, theirs = self.items(), other.items()
+        i = j = 0
+        while i < len(mine) and j < len(theirs):
+            low, high = max(mine[i][0], theirs[j][0]), min(mine[i][1], theirs[j][1])
+            if low <= high:
+                result.starts.append(low)
+                result.ends.append(high)
+            if mine[i][1] < theirs[j][1]:
+                i += 1
+            else:
+                j += 1
+        return result
+
+    def union(self, other: "PortIntervals") -> "PortIntervals":
+        """A new set covering both; cheap when other is the smaller one"""
+        if not other:
+            return self
+        if not self:
+            return other
+        result = PortIntervals()
+        starts, ends = list(self.starts), list(self.ends)
+        for low, high in other.items():
+            # Splice in place of every interval it overlaps or touches
+            first = bisect_left(ends, low - 1)
+            last = bisect_right(starts, high + 1)
+            if first < last:
+                low, high = min(low, starts[first]), max(high, ends[last - 1])
+            starts[first:last] = [low]
+            ends[first:last] = [high]
+        result.starts, result.ends = starts, ends
+        return result
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]], adjacent: bool = True) -> List[Tuple[int, int]]:
+    """Merge overlapping (and, with adjacent=True, touching) closed intervals"""
+    merged: List[List[int]] = []
+    gap = 1 if adjacent else 0
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return [(low, high) for low, high in merged]
+
+def parse_world_open_ports(spec: str) -> Dict[str, Optional[PortIntervals]]:
+    """Parse "dev=*,prod=80;443;8000-8080" into per-environment allowed ports (None allows all)"""
+    policies: Dict[str, Optional[PortIntervals]] = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        environment, ports = (part.strip() for part in item.split("=", 1))
+        environment = normalize_environment(environment)
+        if ports == "*":
+            policies[environment] = None
+            continue
+        intervals = []
+        for port in filter(None, (value.strip() for value in ports.split(";"))):
+            low, _, high = port.partition("-")
+            intervals.append((int(low), int(high or low)))
+        policies[environment] = PortIntervals(intervals)
+    return policies
+
+class _Coverage:
+    """Segment tree tracking how much of a coordinate range a set of half-open intervals covers"""
+
+    def __init__(self, coords: List[int]):
+        self.coords = coords
+        self.index = {coord: i for i, coord in enumerate(coords)}
+        self.count = [0] * (4 * len(coords))
+        self.length = [0] * (4 * len(coords))
+
+    @property
+    def covered(self) -> int:
+        return self.length[1]
+
+    def add(self, start: int, end: int, delta: int):
+        self._update(1, 0, len(self.coords) - 1, self.index[start], self.index[end], delta)
+
+    def _update(self, node: int, low: int, high: int, start: int, end: int, delta: int):
+        if end <= low or high <= start:
+            return
+        if start <= low and high <= end:
+            self.count[node] += delta
+        else:
+            middle = (low + high) // 2
+            self._update(2 * node, low, middle, start, end, delta)
+            self._update(2 * node + 1, middle, high, start, end, delta)
+        if self.count[node]:
+            self.length[node] = self.coords[high] - self.coords[low]
+        elif high - low == 1:
+            self.length[node] = 0
+        else:
+            self.length[node] = self.length[2 * node] + self.length[2 * node + 1]
+
+def world_open_ranges(entries: List[_Entry]) -> List[Tuple[int, int]]:
+    """
+    Ranges (of the entries' comparable port space) allowed from every address
+
+    Sweeps the ranges in order, keeping the total size of the blocks allowed
+    at each point, so 0.0.0.0/1 plus 128.0.0.0/1 counts the same as 0.0.0.0/0.
+    """
+    open_ranges = []
+    for version, bits in ((4, 32), (6, 128)):
+        space = 1 << bits
+        entries_for_version = [entry for entry in entries if entry.block[0] == version]
+        if sum(block[2] - block[1] + 1 for block in {entry.block for entry in entries_for_version}) < space:
+            continue
+
+        coords = sorted({0, space} | {entry.block[1] for entry in entries_for_version} | {entry.block[2] + 1 for entry in entries_for_version})
+        coverage = _Coverage(coords)
+        events = sorted(
+            [(entry.low, 1, entry.block[1], entry.block[2] + 1) for entry in entries_for_version] +
+            [(entry.high + 1, -1, entry.block[1], entry.block[2] + 1) for entry in entries_for_version]
+        )
+        index = 0
+        while index < len(events):
+            port = events[index][0]
+            while index < len(events) and events[index][0] == port:
+                _, delta, start, end = events[index]
+                coverage.add(start, end, delta)
+                index += 1
+            if coverage.covered == space and index < len(events):
+                open_ranges.append((port, events[index][0] - 1))
+    return merge_intervals(open_ranges)
+
+def _field(rule: Dict[str, Any], *names: str) -> Any:
+    # The API takes Terraform's snake_case; the wizard sends camelCase
+    for name in names:
+        if name in rule:
+            return rule[name]
+    return None
+
+def _parse(rules: List[Any], errors: List[str]) -> List[_Entry]:
+    entries = []
+    blocks: Dict[str, tuple] = {}
+    for index, rule in enumerate(rules):
+        prefix = f"Rule #{index + 1}"
+        if not isinstance(rule, dict):
+            errors.append(f"{prefix}: must be an object")
+            continue
+
+        protocol = PROTOCOLS.get(str(_field(rule, "protocol") or "tcp").lower())
+        if protocol is None:
+            errors.append(f"{prefix}: unsupported protocol {rule.get('protocol')!r}")
+            continue
+
+        try:
+            from_port = int(_field(rule, "from_port", "fromPort"))
+            to_port = int(_field(rule, "to_port", "toPort", "from_port", "fromPort"))
+        except (TypeError, ValueError):
+            if protocol != "-1":
+                errors.append(f"{prefix}: from_port and to_port must be integers")
+                continue
+            from_port = to_port = 0
+
+        if protocol in PORT_PROTOCOLS:
+            if not (0 <= from_port <= to_port <= 65535):
+                errors.append(f"{prefix}: invalid port range {from_port}-{to_port}")
+                continue
+            low, high = from_port, to_port
+        elif protocol == "-1":
+            from_port = to_port = 0
+            low, high = FULL_RANGE
+        else:
+            # ICMP: from_port is the type and to_port the code, -1 meaning any
+            if not (-1 <= from_port <= 255 and -1 <= to_port <= 255):
+                errors.append(f"{prefix}: invalid ICMP type/code {from_port}/{to_port}")
+                continue
+            if from_port == -1:
+                low, high = FULL_RANGE
+            elif to_port == -1:
+                low, high = from_port * 256, from_port * 256 + 255
+            else:
+                low = high = from_port * 256 + to_port
+
+        cidr_blocks = _field(rule, "cidr_blocks", "cidrBlocks")
+        if cidr_blocks is None:
+            cidr_block = _field(rule, "cidr_block", "cidrBlock")
+            cidr_blocks = [] if cidr_block is None else [cidr_block]
+        if isinstance(cidr_blocks, str):
+            cidr_blocks = [cidr_blocks]
+        if not isinstance(cidr_blocks, list) or not all(isinstance(cidr, str) for cidr in cidr_blocks):
+            errors.append(f"{prefix}: cidr_blocks must be a list of strings")
+            continue
+        cidr_blocks = [cidr.strip() for cidr in cidr_blocks]
+        if not cidr_blocks or not all(cidr_blocks):
+            errors.append(f"{prefix}: at least one CIDR block is required")
+            continue
+
+        description = str(_field(rule, "description") or "")
+        for cidr in cidr_blocks:
+            block = blocks.get(cidr)
+            if block is None:
+                try:
+                    network = ipaddress.ip_network(cidr, strict=False)
+                except ValueError:
+                    errors.append(f"{prefix}: invalid CIDR block {cidr!r}")
+                    continue
+                first = int(network.network_address)
+                block = blocks[cidr] = (network.version, first, first + network.num_addresses - 1, str(network), network.prefixlen)
+            entries.append(_Entry(protocol, low, high, from_port, to_port, block, description, index))
+    return entries
+
+def _numbers(sources: List[int]) -> str:
+    numbers = ", ".join(f"#{source + 1}" for source in sources[:LABEL_SOURCES])
+    if len(sources) > LABEL_SOURCES:
+        numbers += f" and {len(sources) - LABEL_SOURCES} more"
+    return numbers
+
+def _sources(entries: List[_Entry]) -> str:
+    return "rule " + _numbers(sorted({source for entry in entries for source in entry.sources}))
+
+class RuleAnalysis:
+    """Result of analysing an ingress rule set: the normalized rules, errors and findings"""
+
+    def __init__(self, environment: str, max_warnings: Optional[int] = None):
+        self.environment = environment
+        self.rules: List[Dict[str, Any]] = []
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.stats: Dict[str, int] = {}
+        self.max_warnings = max_warnings
+        self.omitted_warnings = 0
+
+    def warn(self, message: Callable[[], str]):
+        """Add a warning, only counting it once max_warnings are kept"""
+        if self.max_warnings is not None and len(self.warnings) >= self.max_warnings:
+            self.omitted_warnings += 1
+        else:
+            self.warnings.append(message())
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "environment": self.environment,
+            "valid": self.valid,
+            "rules": self.rules,
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "stats": self.stats
+        }
+
+class RuleAnalyzer:
+    """
+    Normalizes security group ingress rules before they are dispatched
+
+    Rules are split into one entry per CIDR block. Entries for the same
+    protocol and block are merged into disjoint port ranges, so duplicates
+    and adjacent ranges collapse. CIDR blocks either nest or are disjoint,
+    so sorting them by start address and walking them with a stack yields
+    each block's enclosing blocks; every stack level carries the union of
+    the port ranges allowed by its block and all enclosing ones. An entry
+    whose ports are covered by that union is shadowed and dropped, and one
+    that intersects it is reported as overlapping. Each check is a binary
+    search, keeping large rule sets in the millisecond range.
+    """
+
+    # Findings beyond this many are summarized
+    MAX_FINDINGS = 50
+
+    def __init__(self, world_open_ports: Optional[Dict[str, Optional[PortIntervals]]] = None, max_rules: int = 60):
+        self.world_open_ports = world_open_ports or {}
+        self.max_rules = max_rules
+        # Environments without a policy of their own get the intersection of all of them
+        self.strictest: Optional[PortIntervals] = None
+        for allowed in self.world_open_ports.values():
+            if allowed is not None:
+                self.strictest = allowed if self.strictest is None else self.strictest.intersection(allowed)
+
+    def policy(self, environment: str) -> Optional[PortIntervals]:
+        """Ports that may be open to anywhere in an environment, None allowing any"""
+        environment = normalize_environment(environment)
+        if environment in self.world_open_ports:
+            return self.world_open_ports[environment]
+        return self.strictest
+
+    def analyze(self, rules: List[Any], environment: str) -> RuleAnalysis:
+        analysis = RuleAnalysis(environment, self.MAX_FINDINGS)
+        if not isinstance(rules, list):
+            analysis.errors.append("ingress_rules must be a list")
+            return analysis
+        if len(rules) > self.max_rules:
+            analysis.errors.append(f"{len(rules)} rules exceed the limit of {self.max_rules} per security group")
+            return analysis
+
+        entries = _parse(rules, analysis.errors)
+        merged = self._merge(entries, analysis)
+        kept = self._drop_shadowed(merged, analysis)
+        self._check_policy(kept, environment, analysis)
+
+        if len(kept) > self.max_rules:
+            analysis.errors.append(
+                f"{len(kept)} rule entries (one per CIDR block) exceed the limit of {self.max_rules} per security group"
+            )
+
+        analysis.rules = self._group(kept)
+        analysis.stats = {
+            "input_rules": len(rules),
+            "input_entries": len(entries),
+            "merged_entries": len(entries) - len(merged),
+            "shadowed_entries": len(merged) - len(kept),
+            "output_entries": len(kept),
+            "output_rules": len(analysis.rules)
+        }
+        if analysis.omitted_warnings:
+            analysis.warnings.append(f"... and {analysis.omitted_warnings} more findings")
+        return analysis
+
+    def _merge(self, entries: List[_Entry], analysis: RuleAnalysis) -> List[_Entry]:
+        # Collapse entries with the same protocol and block into disjoint ranges
+        groups: Dict[tuple, List[_Entry]] = defaultdict(list)
+        for entry in entries:
+            groups[(entry.protocol, entry.block)].append(entry)
+
+        merged = []
+        for (protocol, _), group in groups.items():
+            group.sort(key=lambda entry: (entry.low, -entry.high))
+            current = group[0]
+            for entry in group[1:]:
+                adjacent = protocol in PORT_PROTOCOLS and entry.low == current.high + 1
+                if entry.low <= current.high or adjacent:
+                    if entry.low == current.low and entry.high == current.high:
+                        analysis.warn(lambda: f"{entry.label()} duplicates {current.label()}")
+                    elif entry.high <= current.high:
+                        analysis.warn(lambda: f"{entry.label()} is already allowed by {current.label()}")
+                    else:
+                        analysis.warn(lambda: f"{entry.label()} merged with {current.label()}")
+                    if entry.high > current.high:
+                        # Only port ranges can be widened; ICMP type/code ranges never partially overlap
+                        current.high = current.to_port = entry.high
+                    current.sources.extend(entry.sources)
+                    current.descriptions.extend(d for d in entry.descriptions if d not in current.descriptions)
+                else:
+                    merged.append(current)
+                    current = entry
+            merged.append(current)
+        return merged
+
+    def _drop_shadowed(self, entries: List[_Entry], analysis: RuleAnalysis) -> List[_Entry]:
+        # "-1" entries allow every protocol, so they join each protocol's pass
+        by_protocol: Dict[str, List[_Entry]] = defaultdict(list)
+        for entry in entries:
+            by_protocol[entry.protocol].append(entry)
+        all_traffic = by_protocol.get("-1", [])
+
+        shadowed = set()
+        for protocol, group in by_protocol.items():
+            candidates = group if protocol == "-1" else group + all_traffic
+            shadowed.update(self._scan(protocol, candidates, analysis))
+        return [entry for entry in entries if id(entry) not in shadowed]
+
+    def _scan(self, protocol: str, entries: List[_Entry], analysis: RuleAnalysis) -> set:
+        by_block: Dict[tuple, List[_Entry]] = defaultdict(list)
+        for entry in entries:
+            by_block[entry.block].append(entry)
+        blocks = sorted(by_block, key=lambda block: (block[0], block[1], -block[2]))
+
+        shadowed = set()
+        # [block, own intervals, entries, union with enclosing levels (built when first needed)]
+        stack: List[list] = []
+        for block in blocks:
+            version, first, last = block[:3]
+            while stack and not (
+                stack[-1][0][0] == version and stack[-1][0][1] <= first and last <= stack[-1][0][2]
+            ):
+                stack.pop()
+            enclosing = self._enclosing(stack)
+
+            node_entries = by_block[block]
+            has_all_traffic = any(entry.protocol == "-1" for entry in node_entries) and protocol != "-1"
+            own = []
+            for entry in node_entries:
+                if entry.protocol != protocol:
+                    own.append((entry.low, entry.high))
+                    continue
+                if has_all_traffic or enclosing.covers(entry.low, entry.high):
+                    shadowed.add(id(entry))
+                    analysis.warn(lambda: (
+                        f"{entry.label()} is already allowed by "
+                        f"{self._culprit(stack, entry, shadowed) or 'an all-traffic rule for the same block'}"
+                    ))
+                    continue
+                if enclosing.overlaps(entry.low, entry.high):
+                    analysis.warn(lambda: f"{entry.label()} overlaps {self._culprit(stack, entry, shadowed)}")
+                own.append((entry.low, entry.high))
+
+            stack.append([block, PortIntervals(own), node_entries, None])
+        return shadowed
+
+    @staticmethod
+    def _enclosing(stack: List[list]) -> PortIntervals:
+        # Union of the port ranges allowed by every level of the stack, cached per level
+        pending = len(stack)
+        while pending and stack[pending - 1][3] is None:
+            pending -= 1
+        union = stack[pending - 1][3] if pending else PortIntervals()
+        for level in stack[pending:]:
+            union = level[3] = union.union(level[1])
+        return union
+
+    @staticmethod
+    def _culprit(stack: List[list], entry: _Entry, shadowed: set) -> Optional[str]:
+        # The nearest enclosing entry still kept whose range intersects the given one
+        for _, _, entries, _ in reversed(stack):
+            for other in entries:
+                if other.low <= entry.high and entry.low <= other.high and id(other) not in shadowed:
+                    return other.label()
+        return None
+
+    def _check_policy(self, entries: List[_Entry], environment: str, analysis: RuleAnalysis):
+        allowed = self.policy(environment)
+        if allowed is None:
+            return
+
+        # Blocks only count together, so check the union of every block allowing a port
+        all_traffic = [entry for entry in entries if entry.protocol == "-1"]
+        if world_open_ranges(all_traffic):
+            analysis.errors.append(
+                f"All traffic from anywhere is not allowed in {environment} ({_sources(all_traffic)})"
+            )
+            return
+
+        permitted = ", ".join(f"{low}" if low == high else f"{low}-{high}" for low, high in allowed.items()) or "none"
+        for protocol in PORT_PROTOCOLS:
+            group = [entry for entry in entries if entry.protocol == protocol]
+            if not group:
+                continue
+            for low, high in world_open_ranges(group + all_traffic):
+                if allowed.covers(low, high):
+                    continue
+                ports = str(low) if low == high else f"{low}-{high}"
+                culprits = [entry for entry in group + all_traffic if entry.low <= high and low <= entry.high]
+                analysis.errors.append(
+                    f"{protocol} {ports} is open to anywhere ({_sources(culprits)}); "
+                    f"only ports {permitted} may be open to anywhere in {environment}"
+                )
+
+    @staticmethod
+    def _group(entries: List[_Entry]) -> List[Dict[str, Any]]:
+        # One Terraform rule per protocol, port range and description, listing its blocks
+        groups: Dict[tuple, List[_Entry]] = defaultdict(list)
+        for entry in entries:
+            groups[(entry.protocol, entry.from_port, entry.to_port, "; ".join(entry.descriptions))].append(entry)
+
+        rules = []
+        for (protocol, from_port, to_port, description), group in sorted(groups.items()):
+            blocks = sorted(entry.block for entry in group)
+            rule = {
+                "from_port": from_port,
+                "to_port": to_port,
+                "protocol": protocol,
+                "cidr_blocks": [block[3] for block in blocks]
+            }
+            if description:
+                rule["description"] = description[:255]
+            rules.append(rule)
+        return rules
+
+def _create_analyzer() -> RuleAnalyzer:
+    settings = get_settings()
+    return RuleAnalyzer(parse_world_open_ports(settings.sg_world_open_ports), settings.sg_max_rules)
+
+analyzer = _create_analyzer()
+
+def analyze_ingress_rules(rules: List[Any], environment: str) -> RuleAnalysis:
+    """Normalize ingress rules and check them against the environment's policy"""
+    return analyzer.analyze(rules, environment)
+
+def normalize_ingress_rules(rules: List[Any], environment: str) -> List[Dict[str, Any]]:
+    """Normalized ingress rules, raising InvalidSecurityGroupRules if any error was found"""
+    analysis = analyze_ingress_rules(rules, environment)
+    if not analysis.valid:
+        raise InvalidSecurityGroupRules(analysis.errors)
+    for warning in analysis.warnings:
+        logger.info("Security group rules: %s", warning)
+    return analysis.rules
@@ -1,45 +1,128 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 from datetime import datetime, timedelta
+from typing import Optional
 import json
+import logging
+import re
 
-# Load environment variables
-load_dotenv()
+from src.broadcast import broadcast, DEPLOYMENTS_CHANNEL
+from src.circuit import create_breaker, note_stale, DependencyUnavailable
+from src.config import get_settings
 
-# Initialize Supabase client
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
+logger = logging.getLogger(__name__)
 
-supabase: Client = create_client(supabase_url, supabase_key)
+# Supabase client, created by init_client() from the application startup hook
+_client: Optional[Client] = None
 
 # In-memory cache for frequently accessed deployments
-# Format: {deployment_id: {"data": deployment_data, "expires_at": timestamp}}
+# Format: {deployment_id: {"data": deployment_data, "cached_at": timestamp, "expires_at": timestamp}}
+# Expired entries are kept for CACHE_STALE_SECONDS so they can be served during an outage
 _deployment_cache = {}
 
+# Last successful deployment list, served stale during an outage
+_deployment_list = {"data": None, "cached_at": None}
+
+# Deployments served stale, refreshed by refresh_stale_deployments() after recovery
+_stale_ids = set()
+
+# Deployments whose workflow was dispatched but whose row could not be saved,
+# inserted by save_pending_deployments() once Supabase answers again
+_pending_saves = []
+
+# User rows looked up for authentication, with the same stale fallback as deployments
+# Format: {username: {"data": user_row, "cached_at": timestamp, "expires_at": timestamp}}
+_user_cache = {}
+USER_CACHE_SECONDS = 60
+
+def _is_outage(exc: Exception) -> bool:
+    """Whether an error says the database is unhealthy rather than the request being wrong"""
+    if isinstance(exc, APIError) and exc.code:
+        # PostgREST request errors (PGRST1xx/2xx) and SQLSTATE data, constraint,
+        # permission and syntax errors (classes 22, 23, 42)
+        return not (re.match(r"PGRST[12]", exc.code) or exc.code[:2] in ("22", "23", "42"))
+    return True
+
+breaker = create_breaker("supabase", is_failure=_is_outage)
+
+# Exports, index builds and archiving page through large results; their own
+# breaker, which ignores slow calls, keeps them from failing requests fast for everyone
+background_breaker = create_breaker("supabase_background", is_failure=_is_outage, count_slow_calls=False)
+
+def _execute(query, background: bool = False):
+    """Run a query builder through the Supabase circuit breaker"""
+    return (background_breaker if background else breaker).call(query.execute)
+
+def init_client() -> Client:
+    """Create the Supabase client from settings if it does not exist yet"""
+    global _client
+    if _client is None:
+        settings = get_settings()
+        if not settings.supabase_url or not settings.supabase_key:
+            raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set")
+        _client = create_client(
+            settings.supabase_url,
+            settings.supabase_key,
+            options=ClientOptions(postgrest_client_timeout=settings.supabase_timeout_seconds)
+        )
+    return _client
+
+def get_client() -> Client:
+    """Return the Supabase client, creating it on first use outside the app lifecycle"""
+    return _client if _client is not None else init_client()
+
+def close_client():
+    """Drop the Supabase client on shutdown"""
+    global _client
+    _client = None
+
 def get_user_by_username(username: str):
-    """Get a user from Supabase by username"""
-    response = supabase.table("users").select("*").eq("username", username).execute()
+    """
+    Get a user from Supabase by username, cached for USER_CACHE_SECONDS
+
+    If Supabase fails, an expired cached copy is served so authenticated
+    requests can still reach the stale deployment cache; without one
+    DependencyUnavailable is raised.
+    """
+    now = datetime.utcnow()
+    cache_entry = _user_cache.get(username)
+    if cache_entry and now <= cache_entry["expires_at"]:
+        return cache_entry["data"]
+
+    try:
+        response = _execute(get_client().table("users").select("*").eq("username", username))
+    except Exception as e:
+        if cache_entry and _stale_age(cache_entry["cached_at"]) is not None:
+            logger.warning("Serving cached user %s, Supabase is unavailable: %s", username, e)
+            return cache_entry["data"]
+        raise _unavailable(e) from e
+
     users = response.data
     
     if not users or len(users) == 0:
+        _user_cache.pop(username, None)
         return None
     
+    _user_cache[username] = {
+        "data": users[0],
+        "cached_at": now,
+        "expires_at": now + timedelta(seconds=USER_CACHE_SECONDS)
+    }
     return users[0]
 
 def get_users():
     """Get all users from Supabase"""
-    response = supabase.table("users").select("*").execute()
+    response = _execute(get_client().table("users").select("*"))
     return response.data
 
 def create_user(username: str, email: str, password: str, role: str = "user"):
     """Create a new user in Supabase"""
-    response = supabase.table("users").insert({
+    response = _execute(get_client().table("users").insert({
         "username": username,
         "email": email,
         "password": password,
         "role": role
-    }).execute()
+    }))
     
     return response.data
 
@@ -64,17 +147,43 @@ def save_deployment(deployment_data):
         if "created_at" not in deployment_data:
             deployment_data["created_at"] = datetime.utcnow().isoformat()
             
-        response = supabase.table("deployments").insert(deployment_data).execute()
+        response = _execute(get_client().table("deployments").insert(deployment_data))
         
-        # Update cache with new deployment
+        # Update cache with new deployment and let other workers and indexes know about it
         if "id" in deployment_data:
             cache_deployment(deployment_data["id"], response.data[0] if response.data else deployment_data)
+            broadcast.publish(DEPLOYMENTS_CHANNEL, {"type": "created", "deployment_id": deployment_data["id"]})
             
         return response.data
     except Exception as e:
-        print(f"Error saving deployment: {str(e)}")
+        logger.error("Error saving deployment: %s", e)
         raise
 
+def queue_deployment_save(deployment_data):
+    """Keep a dispatched deployment that could not be saved, so it is inserted after recovery"""
+    cache_deployment(deployment_data["id"], deployment_data)
+    _pending_saves.append(deployment_data)
+
+def save_pending_deployments():
+    """Insert deployments queued by queue_deployment_save() once Supabase answers again"""
+    if not _pending_saves or breaker.is_open:
+        return {"saved_count": 0, "pending_count": len(_pending_saves)}
+
+    saved = 0
+    while _pending_saves:
+        try:
+            save_deployment(_pending_saves[0])
+        except APIError as e:
+            # The first attempt reached the database after all
+            if e.code != "23505":
+                break
+        except Exception:
+            break
+        _pending_saves.pop(0)
+        saved += 1
+
+    return {"saved_count": saved, "pending_count": len(_pending_saves)}
+
 def update_deployment(deployment_id, update_data):
     """Update a deployment in Supabase with cache invalidation"""
     try:
@@ -88,59 +197,142 @@ def update_deployment(deployment_id, update_data):
         if "updated_at" not in update_data:
             update_data["updated_at"] = datetime.utcnow().isoformat()
             
-        response = supabase.table("deployments").update(update_data).eq("id", deployment_id).execute()
+        response = _execute(get_client().table("deployments").update(update_data).eq("id", deployment_id))
         
         # Invalidate cache for this deployment
         invalidate_deployment_cache(deployment_id)
         
         return response.data
     except Exception as e:
-        print(f"Error updating deployment: {str(e)}")
+        logger.error("Error updating deployment %s: %s", deployment_id, e)
         raise
 
 def get_deployments():
-    """Get all deployments from Supabase with improved ordering"""
+    """
+    Get all deployments from Supabase with improved ordering
+
+    During an outage the last list fetched by this worker is served stale;
+    without one, DependencyUnavailable is raised instead of returning an
+    empty list that looks like there are no deployments.
+    """
     try:
-        response = supabase.table("deployments")\
+        response = _execute(get_client().table("deployments")\
             .select("*")\
             .order("created_at", desc=True)\
-            .limit(100)\
-            .execute()
-        return response.data
+            .limit(100))
     except Exception as e:
-        print(f"Error fetching deployments: {str(e)}")
+        logger.error("Error fetching deployments: %s", e)
+        age = _stale_age(_deployment_list["cached_at"])
+        if age is None:
+            raise _unavailable(e) from e
+        note_stale(age)
+        return _deployment_list["data"]
+
+    _deployment_list["data"] = response.data
+    _deployment_list["cached_at"] = datetime.utcnow()
+    return response.data
+
+def iter_deployment_pages(page_size: int = 1000, columns: str = "*", filters=None):
+    """Yield every deployment matching the equality filters in pages, using keyset pagination on id"""
+    last_id = None
+    while True:
+        query = get_client().table("deployments").select(columns)
+        for field, value in (filters or {}).items():
+            query = query.eq(field, value)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = _execute(query.order("id").limit(page_size), background=True).data or []
+
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1]["id"]
+
+def get_deployments_by_ids(deployment_ids, columns: str = "*"):
+    """Fetch several deployments in one query, bypassing the cache"""
+    if not deployment_ids:
         return []
+    response = _execute(get_client().table("deployments").select(columns).in_("id", list(deployment_ids)))
+    return response.data or []
 
 def get_deployment(deployment_id):
-    """Get a deployment from Supabase by ID with caching"""
+    """
+    Get a deployment from Supabase by ID with caching
+
+    Returns None only when the deployment does not exist. If Supabase fails,
+    an expired cached copy is served stale; without one DependencyUnavailable
+    is raised.
+    """
     # Check cache first
     cached = get_cached_deployment(deployment_id)
     if cached:
         return cached
     
     try:
-        response = supabase.table("deployments").select("*").eq("id", deployment_id).execute()
-        deployments = response.data
-        
-        if not deployments or len(deployments) == 0:
-            return None
-        
-        # Cache the result
-        cache_deployment(deployment_id, deployments[0])
-        
-        return deployments[0]
+        response = _execute(get_client().table("deployments").select("*").eq("id", deployment_id))
     except Exception as e:
-        print(f"Error fetching deployment {deployment_id}: {str(e)}")
+        logger.error("Error fetching deployment %s: %s", deployment_id, e)
+        stale = get_stale_deployment(deployment_id)
+        if stale is None:
+            raise _unavailable(e) from e
+        return stale
+
+    deployments = response.data
+    
+    if not deployments or len(deployments) == 0:
         return None
+    
+    # Cache the result
+    cache_deployment(deployment_id, deployments[0])
+    
+    return deployments[0]
+
+def get_deployments_bulk(deployment_ids):
+    """
+    Get several deployments, serving cached ones and fetching the rest in one query
+
+    Returns (deployments, unavailable): the ids in unavailable could not be
+    fetched because Supabase failed and no stale copy was cached, as opposed
+    to ids that simply do not exist. If nothing at all can be served,
+    DependencyUnavailable is raised.
+    """
+    found = {}
+    missing = []
+    unavailable = []
+    for deployment_id in dict.fromkeys(deployment_ids):
+        cached = get_cached_deployment(deployment_id)
+        if cached:
+            found[deployment_id] = cached
+        else:
+            missing.append(deployment_id)
+
+    if missing:
+        try:
+            for deployment in get_deployments_by_ids(missing):
+                cache_deployment(deployment["id"], deployment)
+                found[deployment["id"]] = deployment
+        except Exception as e:
+            logger.error("Error fetching deployments %s: %s", missing, e)
+            for deployment_id in missing:
+                stale = get_stale_deployment(deployment_id)
+                if stale is not None:
+                    found[deployment_id] = stale
+                else:
+                    unavailable.append(deployment_id)
+            if not found:
+                raise _unavailable(e) from e
+
+    deployments = [found[deployment_id] for deployment_id in dict.fromkeys(deployment_ids) if deployment_id in found]
+    return deployments, unavailable
 
 def update_stalled_deployments():
     """Find and update deployments that have been pending for too long"""
     try:
         # Get pending deployments
-        pending_response = supabase.table("deployments")\
+        pending_response = _execute(get_client().table("deployments")\
             .select("*")\
-            .eq("status", "pending")\
-            .execute()
+            .eq("status", "pending"))
             
         pending_deployments = pending_response.data
         
@@ -166,13 +358,14 @@ def update_stalled_deployments():
                     })
                     updated_count += 1
             except Exception as inner_e:
-                print(f"Error processing stalled deployment {deployment.get('id')}: {str(inner_e)}")
+                logger.error("Error processing stalled deployment %s: %s", deployment.get("id"), inner_e)
                 continue
                 
         return {"updated_count": updated_count}
     except Exception as e:
-        print(f"Error updating stalled deployments: {str(e)}")
-        return {"error": str(e)}
+        # Raised so the scheduler records the run as failed
+        logger.error("Error updating stalled deployments: %s", e)
+        raise
 
 def add_deployment_logs(deployment_id, logs):
     """Add logs to a deployment"""
@@ -197,16 +390,101 @@ def add_deployment_logs(deployment_id, logs):
         
         return response
     except Exception as e:
-        print(f"Error adding logs to deployment {deployment_id}: {str(e)}")
+        logger.error("Error adding logs to deployment %s: %s", deployment_id, e)
+        return None
+
+def get_archivable_deployments(statuses, created_before: str, limit: int):
+    """Finished deployments created before a cutoff that are not archived yet, oldest first"""
+    response = _execute(get_client().table("deployments")\
+        .select("*")\
+        .in_("status", statuses)\
+        .lt("created_at", created_before)\
+        .is_("archived_segment", "null")\
+        .order("created_at")\
+        .limit(limit), background=True)
+    return response.data or []
+
+def mark_deployments_archived(deployment_ids, segment: str, archived_fields):
+    """Drop the archived columns from hot rows and record which segment holds them"""
+    update_data = {field: None for field in archived_fields}
+    update_data["archived_segment"] = segment
+    update_data["archived_at"] = datetime.utcnow().isoformat()
+
+    response = _execute(get_client().table("deployments").update(update_data).in_("id", deployment_ids), background=True)
+
+    for deployment_id in deployment_ids:
+        invalidate_deployment_cache(deployment_id)
+
+    return response.data
+
+def acquire_job_lease(job_name: str, holder: str, ttl_seconds: int) -> bool:
+    """Take or renew the lease for a scheduled job; True if this holder owns it"""
+    response = _execute(get_client().rpc("acquire_job_lease", {
+        "job_name": job_name,
+        "lease_holder": holder,
+        "ttl_seconds": ttl_seconds
+    }))
+    return bool(response.data)
+
+def release_job_lease(job_name: str, holder: str):
+    """Give up a job lease held by this holder"""
+    _execute(get_client().table("job_leases").delete().eq("name", job_name).eq("holder", holder))
+
+def warm_deployment_cache(limit: int = 50):
+    """Pre-load the most recent deployments into the cache and return how many were loaded"""
+    # Not through a breaker: the lifecycle retries with its own backoff, and
+    # readiness should follow the database's recovery without waiting for a circuit to close
+    response = get_client().table("deployments")\
+        .select("*")\
+        .order("created_at", desc=True)\
+        .limit(limit)\
+        .execute()
+
+    for deployment in response.data or []:
+        if deployment.get("id"):
+            cache_deployment(deployment["id"], deployment)
+
+    return len(response.data or [])
+
+def refresh_stale_deployments():
+    """Re-fetch deployments that were served stale once Supabase answers again, and prune the cache"""
+    now = datetime.utcnow()
+    stale_limit = timedelta(seconds=get_settings().cache_stale_seconds)
+    for deployment_id, entry in list(_deployment_cache.items()):
+        if now - entry["expires_at"] > stale_limit:
+            _deployment_cache.pop(deployment_id, None)
+
+    if not _stale_ids or breaker.is_open:
+        return {"refreshed_count": 0}
+
+    deployment_ids = list(_stale_ids)
+    found = get_deployments_by_ids(deployment_ids)
+    for deployment in found:
+        cache_deployment(deployment["id"], deployment)
+    _stale_ids.difference_update(deployment_ids)
+
+    return {"refreshed_count": len(found)}
+
+def _stale_age(cached_at) -> Optional[float]:
+    # Age in seconds of data cached at cached_at, or None if too old to serve
+    if cached_at is None:
         return None
+    age = (datetime.utcnow() - cached_at).total_seconds()
+    return age if age <= get_settings().cache_stale_seconds else None
+
+def _unavailable(exc: Exception) -> DependencyUnavailable:
+    if isinstance(exc, DependencyUnavailable):
+        return exc
+    return DependencyUnavailable("supabase", breaker.retry_after() or 5, f"Supabase is unavailable: {exc}")
 
 # Cache management functions
 def cache_deployment(deployment_id, deployment_data):
     """Cache a deployment for 30 seconds"""
-    expiry = datetime.utcnow() + timedelta(seconds=30)
+    now = datetime.utcnow()
     _deployment_cache[deployment_id] = {
         "data": deployment_data,
-        "expires_at": expiry
+        "cached_at": now,
+        "expires_at": now + timedelta(seconds=30)
     }
 
 def get_cached_deployment(deployment_id):
@@ -216,14 +494,35 @@ def get_cached_deployment(deployment_id):
         
     cache_entry = _deployment_cache[deployment_id]
     
-    # Return None if expired
+    # Return None if expired; the entry stays for get_stale_deployment()
     if datetime.utcnow() > cache_entry["expires_at"]:
-        del _deployment_cache[deployment_id]
         return None
         
     return cache_entry["data"]
 
+def get_stale_deployment(deployment_id):
+    """Get a cached deployment regardless of expiry, marking the response stale and queueing a refresh"""
+    cache_entry = _deployment_cache.get(deployment_id)
+    age = _stale_age(cache_entry["cached_at"]) if cache_entry else None
+    if age is None:
+        return None
+
+    note_stale(age)
+    _stale_ids.add(deployment_id)
+    return cache_entry["data"]
+
 def invalidate_deployment_cache(deployment_id):
-    """Remove a deployment from cache"""
-    if deployment_id in _deployment_cache:
-        del _deployment_cache[deployment_id]
\ No newline at end of file
+    """Remove a deployment from this worker's cache and tell the other workers to do the same"""
+    _evict_deployment(deployment_id)
+    broadcast.publish(DEPLOYMENTS_CHANNEL, {"type": "invalidate", "deployment_id": deployment_id})
+
+def _evict_deployment(deployment_id):
+    _deployment_cache.pop(deployment_id, None)
+
+def _on_deployment_event(message):
+    """Drop cached copies when any worker changes a deployment"""
+    # A new row cannot be cached anywhere yet, and the creating worker just cached it
+    if message.get("deployment_id") and message.get("type") != "created":
+        _evict_deployment(message["deployment_id"])
+
+broadcast.subscribe(DEPLOYMENTS_CHANNEL, _on_deployment_event)
@@ -1,16 +1,14 @@
-import os
 import logging
 import uuid
 from typing import Dict, Any
 from datetime import datetime
-from dotenv import load_dotenv
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from src.circuit import DependencyUnavailable
+from src.github_api import trigger_infrastructure_deployment
+from src.security_groups import InvalidSecurityGroupRules
+from src.supabase import save_deployment
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 async def execute_terraform(resource_type: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -31,8 +29,8 @@ async def execute_terraform(resource_type: str, params: Dict[str, Any]) -> Dict[
             - message: Human-readable status message
     """
     try:
-        logger.info(f"Initiating deployment for {resource_type}")
-        logger.info(f"Parameters: {params}")
+        logger.info("Initiating deployment for %s", resource_type)
+        logger.debug("Parameters: %s", params)
         
         # Extract parameters
         # The ResourceRequest in main.py sends these nested parameters
@@ -72,8 +70,6 @@ async def execute_terraform(resource_type: str, params: Dict[str, Any]) -> Dict[
         deployment_params.update(params.get("parameters", {}))
         
         # Trigger the GitHub workflow
-        from src.github_api import trigger_infrastructure_deployment
-        
         result = await trigger_infrastructure_deployment(
             resource_type=resource_type,
             name=name,
@@ -89,15 +85,16 @@ async def execute_terraform(resource_type: str, params: Dict[str, Any]) -> Dict[
             "message": "Deployment initiated through GitHub Actions"
         }
             
+    except (DependencyUnavailable, InvalidSecurityGroupRules):
+        # Raised before the workflow is dispatched; let the API answer with a 503 or 422 instead of recording a failure
+        raise
     except Exception as e:
-        logger.error(f"Error executing Terraform: {str(e)}")
+        logger.error("Error executing Terraform: %s", e)
         # Generate a unique ID even for failed deployments
         error_deployment_id = f"deploy-error-{uuid.uuid4().hex[:8]}"
         
         # Record the failed deployment
         try:
-            from src.supabase import save_deployment
-            
             save_deployment({
                 "id": error_deployment_id,
                 "resource_type": resource_type,
@@ -107,7 +104,7 @@ async def execute_terraform(resource_type: str, params: Dict[str, Any]) -> Dict[
                 "error_message": str(e)
             })
         except Exception as db_error:
-            logger.error(f"Error saving failed deployment: {str(db_error)}")
+            logger.error("Error saving failed deployment: %s", db_error)
         
         return {
             "status": "error",
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the app as the `src` package, the way uvicorn runs it from backend/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("WARMUP_ENABLED", "false")
@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+
+from src.admission import AdmissionController, AdmissionRejected, TokenBucket, UnknownEnvironment, parse_limits
+from src.security_groups import RuleAnalyzer, parse_world_open_ports
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=1, capacity=2)
+    start = bucket.updated
+    bucket.consume()
+    bucket.consume()
+    assert bucket.wait_time(start) == pytest.approx(1.0)
+    assert bucket.wait_time(start + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(start + 1) == 0
+    # Never refills past capacity
+    bucket.wait_time(start + 100)
+    assert bucket.tokens == 2
+
+def test_parse_limits():
+    assert parse_limits("dev=30, staging=20,prod=5") == {"dev": 30.0, "staging": 20.0, "prod": 5.0}
+
+def test_user_rate_limit():
+    controller = AdmissionController(user_per_minute=60, user_burst=2)
+    controller.check_rate("alice", "dev")
+    controller.check_rate("alice", "dev")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.check_rate("alice", "dev")
+    assert rejected.value.retry_after == 1
+    controller.check_rate("bob", "dev")
+
+def test_environment_rate_limit_is_shared():
+    controller = AdmissionController(env_per_minute={"prod": 5})
+    controller.check_rate("alice", "prod")
+    with pytest.raises(AdmissionRejected):
+        controller.check_rate("bob", "prod")
+    assert controller.counters["rejected_environment_rate"] == 1
+
+@pytest.mark.parametrize("environment", ["qa", "prd", ""])
+def test_unknown_environment_is_rejected_before_buckets(environment):
+    controller = AdmissionController(env_per_minute={"prod": 5})
+    with pytest.raises(UnknownEnvironment):
+        controller.check_rate("alice", environment)
+    assert controller._env_buckets == {}
+    assert controller._user_buckets == {}
+
+@pytest.mark.parametrize("environment", ["production", " Prod "])
+def test_environment_aliases_share_the_prod_bucket_and_policy(environment):
+    controller = AdmissionController(env_per_minute={"production": 5})
+    assert controller.check_rate("alice", environment) == "prod"
+    with pytest.raises(AdmissionRejected):
+        controller.check_rate("bob", "prod")
+
+    analyzer = RuleAnalyzer(parse_world_open_ports("dev=*,prod=443"))
+    rules = [{"from_port": 22, "to_port": 22, "protocol": "tcp", "cidr_blocks": ["0.0.0.0/0"]}]
+    assert not analyzer.analyze(rules, environment).valid
+
+def test_validation_failure_refunds_tokens():
+    controller = AdmissionController(env_per_minute={"prod": 5})
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            async with controller.admit("alice", "prod"):
+                raise ValueError("invalid rules")
+        # The team-wide prod token came back, so the next request is admitted
+        async with controller.admit("bob", "prod"):
+            pass
+
+    asyncio.run(scenario())
+    assert controller.counters["refunded"] == 1
+    assert controller.stats()["in_flight"] == 0
+
+def test_other_failures_keep_tokens_spent():
+    controller = AdmissionController(env_per_minute={"prod": 5})
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with controller.admit("alice", "prod"):
+                raise RuntimeError("dispatch failed")
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit("bob", "prod"):
+                pass
+
+    asyncio.run(scenario())
+
+def test_slots_are_handed_out_round_robin():
+    controller = AdmissionController(user_per_minute=600, user_burst=10, max_in_flight=1, max_queued_per_user=3)
+    order = []
+
+    async def request(username: str, label: str, release: asyncio.Event):
+        async with controller.admit(username, "dev"):
+            order.append(label)
+            await release.wait()
+
+    async def scenario():
+        releases = {label: asyncio.Event() for label in ("hold", "a1", "a2", "a3", "b1")}
+        tasks = [asyncio.create_task(request("alice", "hold", releases["hold"]))]
+        await asyncio.sleep(0)
+        # Alice queues three requests before Bob's one
+        for label in ("a1", "a2", "a3"):
+            tasks.append(asyncio.create_task(request("alice", label, releases[label])))
+            await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("bob", "b1", releases["b1"])))
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 4
+
+        for label in ("hold", "a1", "b1", "a2", "a3"):
+            releases[label].set()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == ["hold", "a1", "b1", "a2", "a3"]
+    assert controller.stats()["in_flight"] == 0
+
+def test_queue_limit_per_user():
+    controller = AdmissionController(user_per_minute=600, user_burst=10, max_in_flight=1, max_queued_per_user=1)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("alice", "dev"):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()), asyncio.create_task(hold())]
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit("alice", "dev"):
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert controller.counters["rejected_queue_full"] == 1
+
+def test_queued_request_times_out():
+    controller = AdmissionController(max_in_flight=1, queue_timeout=0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("alice", "dev"):
+                await release.wait()
+
+        task = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit("bob", "dev"):
+                pass
+        release.set()
+        await task
+
+    asyncio.run(scenario())
+    assert controller.counters["rejected_queue_timeout"] == 1
+    assert controller.stats()["waiting"] == 0
+
+def test_requests_without_a_slot_get_tokens_back():
+    controller = AdmissionController(env_per_minute={"dev": 12}, max_in_flight=1, queue_timeout=0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("alice", "dev"):
+                await release.wait()
+
+        task = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        # The dev bucket holds two tokens: one held above, one spent and refunded here
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit("bob", "dev"):
+                pass
+        release.set()
+        await task
+        async with controller.admit("bob", "dev"):
+            pass
+
+    asyncio.run(scenario())
+    assert controller.counters["refunded"] == 1
@@ -0,0 +1,60 @@
+import pytest
+
+from src.search import QueryTooBroad, SearchIndex
+
+def deployment(i, **extra):
+    return {
+        "id": f"deploy-{i}",
+        "name": f"svc-{i}",
+        "resource_type": "ecs_service" if i % 2 else "s3_bucket",
+        "environment": "prod" if i % 3 == 0 else "dev",
+        "region": "eu-west-2",
+        "created_at": f"2026-01-01T00:00:{i:02d}",
+        "parameters": {"container_image": "nginx:latest" if i % 4 else f"myapp:{i}"},
+        **extra
+    }
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    for i in range(60):
+        index.add(deployment(i), bulk=True)
+    index._sort_locked()
+    return index
+
+def brute_force(index, query):
+    matched = set()
+    for deployment_id, terms in index._doc_terms.items():
+        clauses = [index._term(clause) for clause in query.split()]
+        if all(any(t.startswith(term) for t in terms) if prefix else term in terms for term, prefix in clauses):
+            matched.add(deployment_id)
+    return matched
+
+@pytest.mark.parametrize("query", [
+    "container_image:nginx*",
+    "myapp*",
+    "svc-1*",
+    "environment:prod svc-1*",
+    "resource_type:ecs_service container_image:my*",
+    "svc-42 eu*",
+    "svc-4* svc-42*",
+    "environment:prod nothing*"
+])
+def test_prefix_queries_match_brute_force(index, query):
+    result = index.search(query, limit=100)
+    assert {hit["id"] for hit in result["results"]} == brute_force(index, query)
+    assert result["total"] == len(brute_force(index, query))
+
+def test_prefix_strategies_agree(index):
+    expected = brute_force(index, "environment:prod svc-1*")
+    candidates = index._postings[":prod"]
+    assert index._filter_prefix(candidates, ":svc-1") == expected
+    assert index._match_prefix(":svc-1", candidates) == expected
+
+def test_broad_prefix_is_refused_unless_narrowed(index):
+    # Scaled down: "svc*" expands to 61 terms, more than allowed but more than checking one candidate costs
+    index.MAX_PREFIX_TERMS = 10
+    index.FILTER_COST = 4
+    with pytest.raises(QueryTooBroad):
+        index.search("svc*")
+    assert index.search("svc-42 svc*")["total"] == 1
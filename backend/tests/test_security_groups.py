@@ -0,0 +1,140 @@
+import pytest
+
+from src.security_groups import (
+    InvalidSecurityGroupRules,
+    PortIntervals,
+    RuleAnalyzer,
+    normalize_ingress_rules,
+    parse_world_open_ports
+)
+
+def rule(from_port, to_port=None, cidrs=("10.0.0.0/8",), protocol="tcp", **extra):
+    return {
+        "from_port": from_port,
+        "to_port": from_port if to_port is None else to_port,
+        "protocol": protocol,
+        "cidr_blocks": list(cidrs),
+        **extra
+    }
+
+@pytest.fixture
+def analyzer():
+    return RuleAnalyzer(parse_world_open_ports("dev=*,staging=80;443;8080,prod=80;443"), max_rules=60)
+
+def test_port_intervals_merge_and_query():
+    intervals = PortIntervals([(10, 20), (21, 30), (40, 50), (45, 60)])
+    assert intervals.items() == [(10, 30), (40, 60)]
+    assert intervals.covers(12, 30)
+    assert not intervals.covers(25, 45)
+    assert intervals.overlaps(30, 35)
+    assert not intervals.overlaps(31, 39)
+
+def test_port_intervals_union_and_intersection():
+    left = PortIntervals([(0, 10), (20, 30)])
+    right = PortIntervals([(11, 19), (50, 60)])
+    assert left.union(right).items() == [(0, 30), (50, 60)]
+    assert left.intersection(PortIntervals([(5, 25)])).items() == [(5, 10), (20, 25)]
+
+def test_duplicates_and_adjacent_ranges_merge(analyzer):
+    analysis = analyzer.analyze([
+        rule(80),
+        {"fromPort": 80, "toPort": 80, "protocol": "tcp", "cidrBlock": "10.0.0.0/8"},
+        rule(81, 90)
+    ], "dev")
+    assert analysis.valid
+    assert analysis.rules == [{"from_port": 80, "to_port": 90, "protocol": "tcp", "cidr_blocks": ["10.0.0.0/8"]}]
+    assert analysis.stats["merged_entries"] == 2
+    assert any("duplicates" in warning for warning in analysis.warnings)
+
+def test_rules_with_same_ports_are_grouped(analyzer):
+    analysis = analyzer.analyze([rule(22, cidrs=["192.168.0.0/24"]), rule(22, cidrs=["10.0.0.0/8"])], "dev")
+    assert analysis.rules == [{"from_port": 22, "to_port": 22, "protocol": "tcp", "cidr_blocks": ["10.0.0.0/8", "192.168.0.0/24"]}]
+
+def test_shadowed_rules_are_dropped(analyzer):
+    analysis = analyzer.analyze([
+        rule(22, cidrs=["10.0.0.0/8"]),
+        rule(22, cidrs=["10.1.0.0/16"]),
+        rule(0, protocol="-1", cidrs=["192.168.0.0/16"]),
+        rule(5432, cidrs=["192.168.1.0/24"]),
+        rule(-1, -1, protocol="icmp", cidrs=["10.0.0.0/8"]),
+        rule(8, 0, protocol="icmp", cidrs=["10.3.0.0/16"])
+    ], "dev")
+    assert analysis.stats["shadowed_entries"] == 3
+    cidrs = {cidr for kept in analysis.rules for cidr in kept["cidr_blocks"]}
+    assert cidrs == {"10.0.0.0/8", "192.168.0.0/16"}
+    assert "rule #2 (tcp 22 from 10.1.0.0/16) is already allowed by rule #1 (tcp 22 from 10.0.0.0/8)" in analysis.warnings
+
+def test_shadowing_uses_union_of_enclosing_blocks(analyzer):
+    analysis = analyzer.analyze([
+        rule(1000, 2000, cidrs=["10.0.0.0/8"]),
+        rule(2001, 3000, cidrs=["10.1.0.0/16"]),
+        rule(1500, 2500, cidrs=["10.1.2.0/24"])
+    ], "dev")
+    assert analysis.stats["shadowed_entries"] == 1
+    assert all("10.1.2.0/24" not in kept["cidr_blocks"] for kept in analysis.rules)
+
+def test_partial_overlap_is_reported_and_kept(analyzer):
+    analysis = analyzer.analyze([rule(8000, 8090), rule(8085, 9000, cidrs=["10.2.0.0/16"])], "dev")
+    assert analysis.stats["shadowed_entries"] == 0
+    assert len(analysis.rules) == 2
+    assert any("overlaps" in warning for warning in analysis.warnings)
+
+def test_invalid_values_are_errors(analyzer):
+    analysis = analyzer.analyze([
+        rule(70000, 1),
+        rule(22, protocol="gre"),
+        rule(22, cidrs=["not-a-cidr"]),
+        rule(300, 0, protocol="icmp"),
+        "not-a-rule"
+    ], "dev")
+    assert len(analysis.errors) == 5
+
+@pytest.mark.parametrize("cidr_blocks", [[["10.0.0.0/8"]], [{"a": 1}], 5, [None], [], [" "]])
+def test_malformed_cidr_blocks_are_errors(analyzer, cidr_blocks):
+    analysis = analyzer.analyze([{"from_port": 22, "to_port": 22, "protocol": "tcp", "cidr_blocks": cidr_blocks}], "dev")
+    assert analysis.errors and analysis.errors[0].startswith("Rule #1:")
+
+def test_prod_policy_limits_world_open_ports(analyzer):
+    assert analyzer.analyze([rule(443, cidrs=["0.0.0.0/0"])], "prod").valid
+    analysis = analyzer.analyze([rule(22, cidrs=["0.0.0.0/0"])], "prod")
+    assert analysis.errors == ["tcp 22 is open to anywhere (rule #1); only ports 80, 443 may be open to anywhere in prod"]
+    assert analyzer.analyze([rule(22, cidrs=["0.0.0.0/0"])], "dev").valid
+
+def test_world_open_all_traffic_is_rejected(analyzer):
+    analysis = analyzer.analyze([rule(0, protocol="-1", cidrs=["::/0"])], "staging")
+    assert analysis.errors == ["All traffic from anywhere is not allowed in staging (rule #1)"]
+
+def test_split_blocks_covering_everything_count_as_world_open(analyzer):
+    analysis = analyzer.analyze([rule(22, cidrs=["0.0.0.0/1", "128.0.0.0/1"])], "prod")
+    assert not analysis.valid
+    analysis = analyzer.analyze([rule(20, 30, cidrs=["0.0.0.0/1"]), rule(0, protocol="-1", cidrs=["128.0.0.0/1"])], "prod")
+    assert not analysis.valid
+    assert analyzer.analyze([rule(22, cidrs=["0.0.0.0/1", "128.0.0.0/2"])], "prod").valid
+
+@pytest.mark.parametrize("environment", ["Prod", " PRODUCTION ", "prd", "qa", ""])
+def test_unknown_or_misspelled_environments_get_strictest_policy(analyzer, environment):
+    # The intersection of staging and prod only allows 80 and 443
+    assert not analyzer.analyze([rule(22, cidrs=["0.0.0.0/0"])], environment).valid
+    assert not analyzer.analyze([rule(8080, cidrs=["0.0.0.0/0"])], environment).valid
+    assert analyzer.analyze([rule(443, cidrs=["0.0.0.0/0"])], environment).valid
+
+def test_rule_limit(analyzer):
+    analysis = analyzer.analyze([rule(port, cidrs=["10.0.0.0/8", "192.168.0.0/24"]) for port in range(1000, 1062, 2)], "dev")
+    assert any("exceed the limit of 60" in error for error in analysis.errors)
+
+def test_too_many_rules_are_rejected_before_parsing(analyzer):
+    analysis = analyzer.analyze([rule(80)] * 61, "dev")
+    assert analysis.errors == ["61 rules exceed the limit of 60 per security group"]
+    assert not analysis.warnings
+
+def test_findings_are_capped():
+    analyzer = RuleAnalyzer(max_rules=1000)
+    analysis = analyzer.analyze([rule(port) for port in range(1, 1001)], "dev")
+    assert len(analysis.warnings) == RuleAnalyzer.MAX_FINDINGS + 1
+    assert analysis.warnings[-1] == "... and 949 more findings"
+    assert "rule #1, #2, #3 and 47 more (tcp 1-50" in analysis.warnings[-2]
+
+def test_normalize_raises_with_all_errors():
+    with pytest.raises(InvalidSecurityGroupRules) as raised:
+        normalize_ingress_rules([rule(22, cidrs=[["10.0.0.0/8"]]), rule(70000)], "dev")
+    assert len(raised.value.errors) == 2
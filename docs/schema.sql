@@ -41,4 +41,32 @@ AND completed_at IS NULL;
 WHERE status = new_status
 AND completed_at > NOW() - interval '1 minute';
 END;
-$$ LANGUAGE plpgsql;
\ No newline at end of file
+$$ LANGUAGE plpgsql;
+
+-- Leases so that only one API instance runs each scheduled job
+CREATE TABLE job_leases (
+ name TEXT PRIMARY KEY,
+ holder TEXT NOT NULL,
+ expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION acquire_job_lease(job_name text, lease_holder text, ttl_seconds int)
+RETURNS boolean AS $$
+DECLARE
+ acquired boolean;
+BEGIN
+ INSERT INTO job_leases (name, holder, expires_at)
+ VALUES (job_name, lease_holder, NOW() + (ttl_seconds * interval '1 second'))
+ ON CONFLICT (name) DO UPDATE
+ SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+ WHERE job_leases.holder = EXCLUDED.holder OR job_leases.expires_at < NOW()
+ RETURNING true INTO acquired;
+ RETURN COALESCE(acquired, false);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cold archive: finished deployments keep a slim row pointing at the archive segment
+ALTER TABLE deployments ADD COLUMN archived_segment TEXT;
+ALTER TABLE deployments ADD COLUMN archived_at TIMESTAMP WITH TIME ZONE;
+CREATE INDEX deployments_created_at_idx ON deployments (created_at DESC);
+CREATE INDEX deployments_unarchived_idx ON deployments (created_at) WHERE archived_segment IS NULL;
@@ -47,8 +47,11 @@ export const useDeploymentStatus = ({
   const pollingIntervalRef = useRef<NodeJS.Timeout | null>(null);
   const isCompletedRef = useRef<boolean>(false);
   
-  // Helper to fetch deployment status via REST API
-  const fetchDeploymentStatus = async () => {
+  // Stored workflow logs received so far; snapshots only return entries after this
+  const storedLogsRef = useRef<string[]>([]);
+  
+  // Helper to fetch status and logs in a single REST call
+  const fetchDeploymentSnapshot = async () => {
     try {
       const token = localStorage.getItem('token');
       if (!token) {
@@ -57,12 +60,22 @@ export const useDeploymentStatus = ({
       
       setIsLoading(true);
       
-      const response = await apiClient.get(`/api/deployments/${deploymentId}/status`, {
-        headers: { 'Authorization': `Bearer ${token}` }
+      const response = await apiClient.get(`/api/deployments/${deploymentId}/snapshot`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+        params: { after: storedLogsRef.current.length }
       });
       
+      const { summary_logs, logs: newLogs, log_sequence, ...fetchedData } = response.data;
+      
+      // Start over if the stored logs were replaced rather than appended to
+      if (log_sequence < storedLogsRef.current.length) {
+        storedLogsRef.current = [];
+      }
+      storedLogsRef.current = [...storedLogsRef.current, ...(newLogs || [])];
+      setLogs([...(summary_logs || []), ...storedLogsRef.current]);
+      
       const fetchedStatus = {
-        ...response.data,
+        ...fetchedData,
         isLoading: false,
         error: null
       };
@@ -72,9 +85,6 @@ export const useDeploymentStatus = ({
       // Track if deployment is completed to stop polling
       if (fetchedStatus.status === 'completed' || fetchedStatus.status === 'failed') {
         isCompletedRef.current = true;
-        
-        // Fetch logs one last time
-        fetchDeploymentLogs();
       }
       
       setIsLoading(false);
@@ -84,25 +94,10 @@ export const useDeploymentStatus = ({
     }
   };
   
-  // Helper to fetch deployment logs via REST API
-  const fetchDeploymentLogs = async () => {
-    try {
-      const token = localStorage.getItem('token');
-      if (!token) {
-        return;
-      }
-      
-      const response = await apiClient.get(`/api/deployments/${deploymentId}/logs`, {
-        headers: { 'Authorization': `Bearer ${token}` }
-      });
-      
-      if (response.data && response.data.logs) {
-        setLogs(response.data.logs);
-      }
-    } catch (err) {
-      console.error('Error fetching logs:', err);
-    }
-  };
+  // Forget logs from a previously tracked deployment
+  useEffect(() => {
+    storedLogsRef.current = [];
+  }, [deploymentId]);
   
   // Setup WebSocket connection
   useEffect(() => {
@@ -110,7 +105,9 @@ export const useDeploymentStatus = ({
     
     // Determine WebSocket URL (same host as API but ws:// protocol)
     const apiUrl = new URL(apiClient.defaults.baseURL || 'https://platform-hub.onrender.com');
-    const wsUrl = `${apiUrl.protocol === 'https:' ? 'wss:' : 'ws:'}//${apiUrl.host}/ws/deployments/${deploymentId}`;
+    const token = localStorage.getItem('token');
+    const wsUrl = `${apiUrl.protocol === 'https:' ? 'wss:' : 'ws:'}//${apiUrl.host}/ws/deployments/${deploymentId}`
+      + (token ? `?token=${encodeURIComponent(token)}` : '');
     
     // Create WebSocket connection
     const ws = new WebSocket(wsUrl);
@@ -126,7 +123,10 @@ export const useDeploymentStatus = ({
         const data = JSON.parse(event.data);
         
         // Handle different message types
-        if (data.type === 'status_update' && data.data) {
+        if (data.type === 'ping') {
+          // Heartbeat: the server closes sockets that stop answering
+          ws.send(JSON.stringify({ type: 'pong' }));
+        } else if (data.type === 'status_update' && data.data) {
           // Merge with existing status data
           setStatus((prevStatus) => {
             if (!prevStatus) return null;
@@ -138,15 +138,14 @@ export const useDeploymentStatus = ({
             };
           });
           
-          // Fetch updated logs when status changes
-          fetchDeploymentLogs();
+          // Fetch updated outputs and logs when status changes
+          fetchDeploymentSnapshot();
         } else if (data.type === 'deployment_finished') {
           // Final update - deployment is complete
           isCompletedRef.current = true;
           
           // Fetch final status and logs
-          fetchDeploymentStatus();
-          fetchDeploymentLogs();
+          fetchDeploymentSnapshot();
         } else if (data.error) {
           console.error('WebSocket error:', data.error);
           setError(new Error(data.error));
@@ -175,8 +174,7 @@ export const useDeploymentStatus = ({
     };
     
     // Fetch initial status and logs
-    fetchDeploymentStatus();
-    fetchDeploymentLogs();
+    fetchDeploymentSnapshot();
     
     // Cleanup function
     return () => {
@@ -189,8 +187,7 @@ export const useDeploymentStatus = ({
   // Setup polling as fallback or if WebSockets are disabled
   const startPolling = () => {
     // Initial fetch
-    fetchDeploymentStatus();
-    fetchDeploymentLogs();
+    fetchDeploymentSnapshot();
     
     // Start polling interval
     pollingIntervalRef.current = setInterval(() => {
@@ -203,8 +200,7 @@ export const useDeploymentStatus = ({
         return;
       }
       
-      fetchDeploymentStatus();
-      fetchDeploymentLogs();
+      fetchDeploymentSnapshot();
     }, pollingInterval);
   };
   
@@ -223,8 +219,7 @@ export const useDeploymentStatus = ({
   
   // Expose refetch method to manually trigger a refresh
   const refetch = () => {
-    fetchDeploymentStatus();
-    fetchDeploymentLogs();
+    fetchDeploymentSnapshot();
   };
   
   return { status, logs, refetch };